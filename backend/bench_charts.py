@@ -0,0 +1,34 @@
+# Benchmark for the chart-shaping stage: python bench_charts.py [rows]
+import sys
+import json
+import time
+import numpy as np
+from charts import build_chart, lttb
+
+def timed(label, fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - started)
+    print(f"{label:<34} {best * 1000:9.1f} ms")
+    return out
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rng = np.random.default_rng(7)
+    x = np.arange(n, dtype=float)
+    y = np.cumsum(rng.normal(size=n))
+    series = list(zip(x.tolist(), y.tolist()))
+    categories = [(f"category_{i % 5000}", float(v)) for i, v in enumerate(rng.gamma(2.0, 10.0, size=n))]
+    print(f"rows: {n:,}")
+
+    timed("lttb indices (numpy arrays)", lambda: lttb(x, y, 500))
+    for chart_type, rows in [("line", series), ("area", series), ("bar", series), ("pie", categories), ("bar", categories)]:
+        chart = timed(f"build_chart {chart_type} ({'numeric' if rows is series else 'categorical'} x)", lambda: build_chart(f"{chart_type} chart", ["x", "y"], rows), repeat=1)
+        shaped = len(json.dumps(chart))
+        raw = len(json.dumps([{"x": a, "y": b} for a, b in rows[:100_000]])) * (n / min(n, 100_000))
+        print(f"    {chart['sampled']} payload {shaped / 1024:.1f} KiB vs ~{raw / 1024 / 1024:.1f} MiB unshaped")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# Benchmark for substring search over a text column: python bench_fts.py [rows]
+# Compares a LIKE scan of the base table with the same predicate routed through the trigram FTS5 index.
+import os
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+from fts import build_indexes, search
+from sql_optimizer import optimize_sql
+
+WORDS = ("free prize win cash claim call now txt reply stop urgent offer ok later home lunch meet "
+         "tonight sorry love thanks good morning where when what today tomorrow week going come").split()
+
+def timed(label, fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - started)
+    print(f"{label:<44} {best * 1000:9.1f} ms")
+    return out
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rng = random.Random(7)
+    path = os.path.join(tempfile.mkdtemp(), "bench_fts.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE messages (category TEXT, message TEXT)")
+    conn.executemany("INSERT INTO messages VALUES (?, ?)", (
+        ("spam" if rng.random() < 0.13 else "ham", " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 25))) + f" #{i}")
+        for i in range(n)
+    ))
+    conn.commit()
+    print(f"rows: {n:,}")
+
+    timed("build trigram index", lambda: build_indexes(path, "messages"), repeat=1)
+    for pattern in ["%free prize%", "%urgent offer now%", "%#123456%"]:
+        like = f"SELECT COUNT(*) FROM messages WHERE message LIKE '{pattern}'"
+        routed, _ = optimize_sql(path, like)
+        a = timed(f"LIKE scan   {pattern}", lambda: conn.execute(like).fetchone()[0])
+        b = timed(f"FTS routed  {pattern}", lambda: conn.execute(routed).fetchone()[0])
+        assert a == b, (a, b)
+        print(f"    {a:,} matching rows")
+    timed("bm25 top 20 'free prize'", lambda: search(path, "messages", "message", "free prize"))
+    conn.close()
+    os.remove(path)
+
+if __name__ == "__main__":
+    main()
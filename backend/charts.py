@@ -0,0 +1,207 @@
+import os
+import re
+import base64
+import numbers
+import numpy as np
+import pandas as pd
+
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "500"))
+PIE_MAX_SLICES = int(os.getenv("PIE_MAX_SLICES", "8"))
+BAR_MAX_BARS = int(os.getenv("BAR_MAX_BARS", "40"))
+
+PIE_MAX_CATEGORIES = 6
+PROFILE_SAMPLE = 2000
+
+# Only an explicitly named chart type overrides the recommender. The noun is required
+# ("total sales by area", "product line" are not chart requests); only "pie" stands alone.
+EXPLICIT_CHART_RE = re.compile(r"\b(?:(bar|line|pie|area)\s*(?:chart|graph|plot)s?|(pie))\b", re.IGNORECASE)
+VISUAL_RE = re.compile(r"\b(plot|graph|chart|visuali[sz]e|diagram)\b|show me", re.IGNORECASE)
+TEMPORAL_NAME_RE = re.compile(r"(^|_)(date|time|timestamp|day|week|month|quarter|year|period)s?($|_)", re.IGNORECASE)
+ADDITIVE_NAME_RE = re.compile(r"(^|_)(n|cnt|count|total|sum|num|number|amount|qty|quantity|share|messages|records|rows)s?($|_|\()", re.IGNORECASE)
+TEMPORAL_VALUE_RE = re.compile(r"^\d{4}-\d{2}(-\d{2})?([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?$")
+
+def is_number(value):
+    return isinstance(value, numbers.Number) and not isinstance(value, bool)
+
+def requested_chart_type(question):
+    match = EXPLICIT_CHART_RE.search(question or "")
+    return (match.group(1) or match.group(2)).lower() if match else None
+
+def wants_visual(question):
+    return bool(VISUAL_RE.search(question or "")) or requested_chart_type(question) is not None
+
+def profile_column(name, values):
+    present = [v for v in values if v is not None]
+    numeric = bool(present) and all(is_number(v) for v in present)
+    if numeric:
+        temporal = bool(TEMPORAL_NAME_RE.search(name)) and all(float(v).is_integer() and 1800 <= v <= 2200 for v in present)
+    else:
+        strings = [str(v) for v in present]
+        temporal = bool(strings) and sum(bool(TEMPORAL_VALUE_RE.match(v)) for v in strings) >= 0.9 * len(strings)
+    return {
+        "name": name,
+        "numeric": numeric and not temporal,
+        "temporal": temporal,
+        "distinct": len(set(present)),
+        "non_negative": numeric and all(v >= 0 for v in present),
+    }
+
+# Picks chart type and axes from the shape of the result alone (no LLM involvement):
+#   time-like x -> line (area when the measure never decreases, e.g. cumulative totals)
+#   few categories with a non-negative, additive measure (count/total/sum...) -> pie, other categories -> bar
+#   numeric x with many distinct values -> line, otherwise bar
+# Returns None when the result is not worth a chart (single row, no measure, wide raw rows
+# the user did not ask to see plotted).
+def recommend_chart(columns, rows, question=""):
+    if len(rows) < 2 or len(columns) < 2:
+        return None
+    sample = rows[:PROFILE_SAMPLE]
+    profiles = [profile_column(name, [r[i] for r in sample]) for i, name in enumerate(columns)]
+
+    measures = [i for i, p in enumerate(profiles) if p["numeric"]]
+    if not measures:
+        return None
+    temporal = [i for i, p in enumerate(profiles) if p["temporal"]]
+    categorical = [i for i, p in enumerate(profiles) if not p["numeric"] and not p["temporal"]]
+
+    if temporal:
+        x = temporal[0]
+    elif categorical:
+        x = categorical[0]
+    elif len(measures) >= 2:
+        x = measures[0]
+    else:
+        return None
+    y = next(i for i in measures if i != x)
+
+    explicit = requested_chart_type(question)
+    if len(columns) > 3 and not (explicit or wants_visual(question)):
+        return None
+
+    px, py = profiles[x], profiles[y]
+    ordered = sorted(sample, key=lambda r: str(r[x])) if px["temporal"] else sample
+    ys = np.asarray([r[y] for r in ordered if r[y] is not None], dtype=float)
+    if px["temporal"]:
+        chart_type = "area" if len(ys) > 2 and np.all(np.diff(ys) >= 0) else "line"
+    elif not px["numeric"]:
+        parts_of_whole = py["non_negative"] and bool(ADDITIVE_NAME_RE.search(py["name"]))
+        chart_type = "pie" if parts_of_whole and px["distinct"] <= PIE_MAX_CATEGORIES and px["distinct"] == len(sample) else "bar"
+    else:
+        chart_type = "line" if px["distinct"] > BAR_MAX_BARS else "bar"
+
+    return {"chartType": explicit or chart_type, "x": x, "y": y, "temporal": px["temporal"]}
+
+# Largest-Triangle-Three-Buckets: keeps the points that preserve the visual shape of a series.
+# Returns the indices to keep (always including the first and last point).
+def lttb(x, y, threshold):
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        nxt_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:nxt_end].mean() if nxt_end > end else x[-1]
+        avg_y = y[end:nxt_end].mean() if nxt_end > end else y[-1]
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        keep[i + 1] = a
+    return keep
+
+# Additive measures (counts, totals) are summed per label and into "Other"; anything else
+# (scores, prices, rates) is averaged, since a sum of scores means nothing
+def top_n_with_other(labels, values, n, additive=True):
+    # Repeated labels are one slice/bar, so combine them before ranking
+    grouped = pd.Series(values).groupby(pd.Series(labels, dtype=object), sort=False).agg(["sum", "count"])
+    sums, counts = grouped["sum"].to_numpy(), grouped["count"].to_numpy()
+    values = sums if additive else sums / counts
+    labels = grouped.index.tolist()
+    if len(grouped) <= n:
+        return labels, values
+    order = np.argsort(-values, kind="stable")
+    head, tail = order[:n - 1], order[n - 1:]
+    other = sums[tail].sum() if additive else sums[tail].sum() / counts[tail].sum()
+    out_labels = [labels[i] for i in head] + ["Other"]
+    out_values = np.append(values[head], other)
+    return out_labels, out_values
+
+def bin_numeric(x, y, bins):
+    edges = np.linspace(x.min(), x.max(), bins + 1)
+    idx = np.clip(np.searchsorted(edges, x, side="right") - 1, 0, bins - 1)
+    counts = np.bincount(idx, minlength=bins)
+    sums = np.bincount(idx, weights=y, minlength=bins)
+    filled = counts > 0
+    labels = [f"{edges[i]:.4g}–{edges[i + 1]:.4g}" for i in np.flatnonzero(filled)]
+    return labels, sums[filled] / counts[filled]
+
+# Reduces a result to what the chart type can actually show: LTTB for line/area,
+# top slices + "Other" for pie, value bins (numeric x) or top bars + "Other" for bar.
+# additive: whether y can be summed across rows (see top_n_with_other).
+def shape_series(chart_type, xs, ys, max_points=CHART_MAX_POINTS, additive=True):
+    n = len(ys)
+    if chart_type in ("line", "area") and n > max_points:
+        numeric_x = all(is_number(v) for v in xs)
+        x = np.asarray(xs, dtype=float) if numeric_x else np.arange(n, dtype=float)
+        keep = lttb(x, ys, max_points)
+        return [xs[i] for i in keep], ys[keep], "lttb"
+    if chart_type == "pie" and n > PIE_MAX_SLICES:
+        labels, values = top_n_with_other(xs, ys, PIE_MAX_SLICES, additive)
+        return labels, values, "top_n" if additive else "top_n_mean"
+    if chart_type == "bar" and n > BAR_MAX_BARS:
+        if all(is_number(v) for v in xs):
+            labels, values = bin_numeric(np.asarray(xs, dtype=float), ys, BAR_MAX_BARS)
+            return labels, values, "binned_mean"
+        labels, values = top_n_with_other(xs, ys, BAR_MAX_BARS, additive)
+        return labels, values, "top_n" if additive else "top_n_mean"
+    return list(xs), ys, None
+
+# Numeric series travel as base64 little-endian int32/float64 buffers the browser can view as
+# a typed array without parsing; anything else stays a plain JSON list.
+def encode_column(values):
+    if len(values) == 0 or not all(is_number(v) for v in values):
+        return [v if v is None or isinstance(v, (str, int, float)) else str(v) for v in values]
+    arr = np.asarray(values, dtype=float)
+    if np.all(np.mod(arr, 1) == 0) and np.abs(arr).max() < 2 ** 31:
+        return {"dtype": "int32", "data": base64.b64encode(arr.astype("<i4").tobytes()).decode()}
+    return {"dtype": "float64", "data": base64.b64encode(arr.astype("<f8").tobytes()).decode()}
+
+# Builds the chart object the frontend renders ({type, chartType, xAxis, yAxis, data, title})
+# straight from a SQL result, with type and axes from recommend_chart().
+# chart_format="columnar" replaces the row objects in `data` with one encoded array per axis.
+def build_chart(question, columns, rows, max_points=CHART_MAX_POINTS, chart_format="rows"):
+    rec = recommend_chart(columns, rows, question)
+    if rec is None:
+        return None
+    x, y, chart_type = rec["x"], rec["y"], rec["chartType"]
+
+    pairs = [(r[x], r[y]) for r in rows if r[y] is not None and is_number(r[y])]
+    if not pairs:
+        return None
+    # Lines are drawn (and LTTB picks points) in x order; categorical x keeps the query's order
+    if chart_type in ("line", "area") and (rec["temporal"] or all(is_number(p[0]) for p in pairs)):
+        pairs.sort(key=lambda p: (p[0] is None, str(p[0]) if not is_number(p[0]) else p[0]))
+    xs = [p[0] for p in pairs]
+    ys = np.fromiter((p[1] for p in pairs), dtype=float, count=len(pairs))
+
+    additive = bool(ADDITIVE_NAME_RE.search(columns[y]))
+    xs, ys, method = shape_series(chart_type, xs, ys, max_points, additive)
+    chart = {
+        "type": "chart",
+        "chartType": chart_type,
+        "xAxis": columns[x],
+        "yAxis": columns[y],
+        "title": question.strip()[:80],
+    }
+    if chart_format == "columnar":
+        chart["format"] = "columnar"
+        chart["length"] = len(xs)
+        chart["columns"] = {columns[x]: encode_column(xs), columns[y]: encode_column(ys)}
+    else:
+        chart["data"] = [{columns[x]: xv, columns[y]: float(yv)} for xv, yv in zip(xs, ys.tolist())]
+    if method:
+        chart["sampled"] = {"method": method, "from": len(pairs), "to": len(xs)}
+    return chart
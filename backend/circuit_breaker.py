@@ -0,0 +1,89 @@
+import os
+import time
+import threading
+from metrics import metrics
+
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_OPEN_S = int(os.getenv("BREAKER_OPEN_S", "30"))
+# Calls let through at once while half-open
+BREAKER_PROBES = 1
+
+class CircuitOpenError(Exception):
+    def __init__(self, retry_in):
+        super().__init__(f"LLM provider unavailable, circuit open for another {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+# closed: calls go through, consecutive failures are counted.
+# open: after BREAKER_FAILURES failures in a row every call fails at once for BREAKER_OPEN_S.
+# half-open: then up to BREAKER_PROBES calls are let through; a success closes the
+# circuit, a failure opens it again.
+class CircuitBreaker:
+    def __init__(self, name="llm"):
+        self.name = name
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.probes = 0
+        self._lock = threading.Lock()
+
+    def retry_in(self, now=None):
+        if self.state != "open":
+            return 0
+        return max(0.0, self.opened_at + BREAKER_OPEN_S - (now or time.monotonic()))
+
+    # Raises CircuitOpenError instead of letting the call through
+    def before_call(self):
+        with self._lock:
+            if self.state == "open":
+                retry_in = self.retry_in()
+                if retry_in > 0:
+                    metrics.incr(f"breaker_rejected.{self.name}")
+                    raise CircuitOpenError(retry_in)
+                self._set_state("half_open")
+            if self.state == "half_open":
+                if self.probes >= BREAKER_PROBES:
+                    metrics.incr(f"breaker_rejected.{self.name}")
+                    raise CircuitOpenError(0)
+                self.probes += 1
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            if self.state == "half_open":
+                self._end_probe()
+                self._set_state("closed")
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open":
+                self._end_probe()
+                self._open()
+            elif self.state == "closed" and self.failures >= BREAKER_FAILURES:
+                self._open()
+
+    # A call that ended in an error that says nothing about the provider's health
+    def record_ignored(self):
+        with self._lock:
+            if self.state == "half_open":
+                self._end_probe()
+
+    # Calls started before the circuit opened may finish while it is half-open
+    def _end_probe(self):
+        self.probes = max(0, self.probes - 1)
+
+    def _open(self):
+        self.opened_at = time.monotonic()
+        self._set_state("open")
+
+    def _set_state(self, state):
+        if state != self.state:
+            print(f"Circuit breaker {self.name}: {self.state} -> {state}")
+            metrics.incr(f"breaker_{state}.{self.name}")
+        self.state = state
+        if state != "half_open":
+            self.probes = 0
+
+    def snapshot(self):
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self.failures, "retry_in_s": round(self.retry_in(), 1)}
@@ -0,0 +1,95 @@
+import os
+import re
+import math
+import sqlite3
+import threading
+from collections import Counter
+from schemas import table_schemas, table_version, quote_ident
+
+COLUMN_FOCUS_MIN = int(os.getenv("COLUMN_FOCUS_MIN", "40"))
+COLUMN_TOP_K = int(os.getenv("COLUMN_TOP_K", "25"))
+COLUMN_SAMPLE_ROWS = 200
+COLUMN_SAMPLE_VALUES = 5
+NAME_WEIGHT = 3.0
+
+_indexes = {}
+_lock = threading.Lock()
+
+WORD_RE = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+
+def _stem(word):
+    return word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+
+def terms(text):
+    return [_stem(w.lower()) for w in WORD_RE.findall(str(text))]
+
+# Lexical index over a wide table's columns: name words (weighted), storage class and a few
+# sample values per column. Questions are scored against it with IDF-weighted term overlap.
+class ColumnIndex:
+    def __init__(self, columns, docs):
+        self.columns = columns
+        self.docs = docs
+        df = Counter(t for doc in docs for t in doc)
+        self.idf = {t: math.log((len(docs) + 1) / (n + 1)) + 1 for t, n in df.items()}
+
+    def rank(self, text):
+        query = set(terms(text))
+        scored = []
+        for column, doc in zip(self.columns, self.docs):
+            score = 0.0
+            for t in query:
+                if t in doc:
+                    score += self.idf[t] * doc[t]
+                elif len(t) >= 4:
+                    # Abbreviated names: "rev" for revenue, "qty" style prefixes
+                    score += 0.5 * max((self.idf[d] * w for d, w in doc.items() if len(d) >= 3 and t.startswith(d)), default=0)
+            if score:
+                scored.append((score / math.sqrt(sum(doc.values())), column))
+        return [c for _, c in sorted(scored, key=lambda s: -s[0])]
+
+    # Top-k columns for the question plus any the caller insists on, in table order
+    def select(self, question, k=COLUMN_TOP_K, extra=()):
+        chosen = set(self.rank(question)[:k]) | {c.lower() for c in extra}
+        # Keep the leading column (usually the row key) so results stay identifiable
+        chosen.add(self.columns[0])
+        return [c for c in self.columns if c in chosen]
+
+    # After a missing-column error: double the set and pull in columns resembling the missing name
+    def widen(self, current, question, missing):
+        chosen = set(current) | set(self.rank(question)[:max(len(current) * 2, COLUMN_TOP_K)]) | set(self.rank(missing)[:COLUMN_SAMPLE_VALUES])
+        return [c for c in self.columns if c in chosen]
+
+def _build(db_path, table, columns):
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(f"SELECT * FROM {quote_ident(table)} LIMIT ?", (COLUMN_SAMPLE_ROWS,)).fetchall()
+    finally:
+        conn.close()
+    docs = []
+    for i, (name, kind) in enumerate(columns):
+        doc = Counter()
+        for t in terms(name.replace("_", " ")):
+            doc[t] += NAME_WEIGHT
+        doc[kind.lower()] += 1
+        if kind == "TEXT":
+            samples = list(dict.fromkeys(r[i] for r in rows if r[i] is not None))[:COLUMN_SAMPLE_VALUES]
+            for value in samples:
+                for t in set(terms(value)):
+                    doc[t] += 1
+        docs.append(doc)
+    return ColumnIndex([name for name, _ in columns], docs)
+
+# Index for tables wider than COLUMN_FOCUS_MIN columns, None for narrow ones
+def column_index(db_path, table):
+    schema = table_schemas(db_path).get(table)
+    if not schema or len(schema["columns"]) <= COLUMN_FOCUS_MIN:
+        return None
+    # Sample values make this per table and per table version, not per fingerprint
+    key, version = (db_path, table), table_version(db_path, table)
+    cached = _indexes.get(key)
+    if cached and cached[0] == version:
+        return cached[1]
+    index = _build(db_path, table, schema["columns"])
+    with _lock:
+        _indexes[key] = (version, index)
+    return index
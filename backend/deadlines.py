@@ -0,0 +1,44 @@
+import os
+import time
+import contextvars
+from contextlib import contextmanager
+
+from metrics import metrics
+
+REQUEST_DEADLINE_MS = int(os.getenv("REQUEST_DEADLINE_MS", "60000"))
+# Upper bound for a per-request deadline_ms
+REQUEST_DEADLINE_MAX_MS = int(os.getenv("REQUEST_DEADLINE_MAX_MS", "300000"))
+
+# Monotonic time by which the current request has to be answered (None outside a request)
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+class DeadlineExceeded(TimeoutError):
+    def __init__(self, stage):
+        super().__init__(f"Request deadline exceeded during {stage}")
+        self.stage = stage
+
+# started: monotonic arrival time, so time spent queueing counts against the deadline
+@contextmanager
+def request_deadline(ms=None, started=None):
+    ms = min(ms or REQUEST_DEADLINE_MS, REQUEST_DEADLINE_MAX_MS)
+    token = _deadline.set((started or time.monotonic()) + ms / 1000)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def remaining_s():
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def deadline_passed():
+    remaining = remaining_s()
+    return remaining is not None and remaining <= 0
+
+def deadline_exceeded(stage):
+    metrics.incr(f"deadline_exceeded.{stage}")
+    return DeadlineExceeded(stage)
+
+def check_deadline(stage):
+    if deadline_passed():
+        raise deadline_exceeded(stage)
@@ -0,0 +1,88 @@
+import re
+import difflib
+
+ENTITY_MAX_NGRAM = 4
+ENTITY_MAX_HINTS = 8
+FUZZY_CUTOFF = 0.85
+MIN_PREFIX_CHARS = 3
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "for", "to", "and", "or", "is", "are", "was", "were", "be", "by", "with",
+    "what", "which", "who", "how", "many", "much", "me", "show", "give", "list", "count", "number", "all", "per",
+    "each", "from", "that", "this", "it", "do", "does", "average", "avg", "total", "sum", "top", "most", "least",
+}
+# Filler words people add to a value ("science dept", "sales team")
+FILLER = {"dept", "department", "team", "group", "category", "type", "class", "section", "division", "unit"}
+
+def normalize(text):
+    return " ".join(WORD_RE.findall(str(text).lower()))
+
+def _mentions(question):
+    words = WORD_RE.findall(question.lower())
+    quoted = [normalize(q) for q in re.findall(r"['\"]([^'\"]+)['\"]", question)]
+    grams = []
+    for n in range(ENTITY_MAX_NGRAM, 0, -1):
+        for i in range(len(words) - n + 1):
+            gram = words[i:i + n]
+            if gram[0] in STOPWORDS or gram[-1] in STOPWORDS:
+                continue
+            grams.append(" ".join(gram))
+    return list(dict.fromkeys(quoted + grams))
+
+# How well a question phrase names a value: exact > all value words present > abbreviation > typo
+def _match(mention, value):
+    if mention == value:
+        return 1.0, "exact"
+    m_words, v_words = mention.split(), value.split()
+    rest = [w for w in m_words if w not in v_words]
+    if set(v_words) <= set(m_words) and all(w in FILLER for w in rest):
+        return 0.9, "exact"
+    if len(m_words) == 1 and len(mention) >= MIN_PREFIX_CHARS and value.startswith(mention) and len(mention) < len(value):
+        return 0.6 + 0.3 * len(mention) / len(value), "prefix"
+    if len(mention) >= 4 and abs(len(mention) - len(value)) <= 2:
+        matcher = difflib.SequenceMatcher(None, mention, value)
+        if matcher.quick_ratio() >= FUZZY_CUTOFF and matcher.ratio() >= FUZZY_CUTOFF:
+            return matcher.ratio() * 0.8, "fuzzy"
+    return 0.0, None
+
+# Maps phrases in the question to exact values of categorical columns ({column: [values]}).
+# Returns [(mention, column, [values], how)], longest/most certain mentions first.
+def resolve_entities(question, categorical):
+    index = [(column, value, normalize(value)) for column, values in categorical.items() for value in values]
+    index = [entry for entry in index if len(entry[2]) >= 2]
+    if not index:
+        return []
+
+    resolved, covered = [], set()
+    for mention in _mentions(question):
+        if set(mention.split()) <= covered:
+            continue
+        scored = []
+        for column, value, norm in index:
+            score, how = _match(mention, norm)
+            if how:
+                scored.append((score, how, column, value))
+        if not scored:
+            continue
+        best = max(s[0] for s in scored)
+        top = [s for s in scored if s[0] >= best - 1e-9]
+        columns = {}
+        for _, how, column, value in top:
+            columns.setdefault(column, []).append(value)
+        for column, values in columns.items():
+            resolved.append((mention, column, values[:3], top[0][1]))
+        covered |= set(mention.split())
+        if len(resolved) >= ENTITY_MAX_HINTS:
+            break
+    return resolved
+
+def describe_entities(resolved):
+    if not resolved:
+        return ""
+    lines = []
+    for mention, column, values, how in resolved:
+        options = " or ".join("'" + v.replace("'", "''") + "'" for v in values)
+        lines.append(f"- \"{mention}\" -> {column} = {options}")
+    return ("\n\nVALUE HINTS (exact values found in the data for words in the question; "
+            "filter with = on these instead of LIKE):\n" + "\n".join(lines))
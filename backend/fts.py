@@ -0,0 +1,129 @@
+import os
+import re
+import sqlite3
+import threading
+from sessions import TURN_TABLE_PREFIX
+from schemas import table_version, quote_ident
+
+FTS_TABLE_PREFIX = "fts_idx_"
+FTS_MIN_ROWS = int(os.getenv("FTS_MIN_ROWS", "1000"))
+FTS_MIN_AVG_CHARS = int(os.getenv("FTS_MIN_AVG_CHARS", "30"))
+FTS_SAMPLE_ROWS = 1000
+# The trigram tokenizer can only use the index for runs of at least 3 characters
+MIN_TRIGRAM_CHARS = 3
+
+_checked = {}
+_lock = threading.Lock()
+
+def index_name(table, column):
+    return f"{FTS_TABLE_PREFIX}{table}_{column}"
+
+def _exists(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone() is not None
+
+# Long free-text columns of tables big enough for a scan to hurt
+def text_columns(conn, table):
+    if table.startswith((TURN_TABLE_PREFIX, FTS_TABLE_PREFIX)):
+        return []
+    if conn.execute(f"SELECT COUNT(*) FROM {quote_ident(table)}").fetchone()[0] < FTS_MIN_ROWS:
+        return []
+    columns = []
+    for col in conn.execute(f"PRAGMA table_info({quote_ident(table)})").fetchall():
+        if "TEXT" not in (col[2] or "").upper() and "CHAR" not in (col[2] or "").upper():
+            continue
+        name = quote_ident(col[1])
+        avg = conn.execute(f"SELECT AVG(LENGTH({name})) FROM (SELECT {name} FROM {quote_ident(table)} LIMIT ?)", (FTS_SAMPLE_ROWS,)).fetchone()[0]
+        if avg and avg >= FTS_MIN_AVG_CHARS:
+            columns.append(col[1])
+    return columns
+
+# External-content FTS5 table over one column, kept in sync with the base table by triggers.
+# The trigram tokenizer makes col LIKE '%...%' on the index return exactly what it does on the table.
+def create_index(conn, table, column):
+    name = index_name(table, column)
+    idx, tab, col = quote_ident(name), quote_ident(table), quote_ident(column)
+    conn.execute(f"DROP TABLE IF EXISTS {idx}")
+    conn.execute(f'CREATE VIRTUAL TABLE {idx} USING fts5({col}, content={tab}, content_rowid="rowid", tokenize="trigram")')
+    conn.execute(f"INSERT INTO {idx}({idx}) VALUES ('rebuild')")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS {quote_ident(name + '_ai')} AFTER INSERT ON {tab} BEGIN "
+                 f"INSERT INTO {idx}(rowid, {col}) VALUES (new.rowid, new.{col}); END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS {quote_ident(name + '_ad')} AFTER DELETE ON {tab} BEGIN "
+                 f"INSERT INTO {idx}({idx}, rowid, {col}) VALUES ('delete', old.rowid, old.{col}); END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS {quote_ident(name + '_au')} AFTER UPDATE ON {tab} BEGIN "
+                 f"INSERT INTO {idx}({idx}, rowid, {col}) VALUES ('delete', old.rowid, old.{col}); "
+                 f"INSERT INTO {idx}(rowid, {col}) VALUES (new.rowid, new.{col}); END")
+    return name
+
+# Indexes whose content table is `table` (found by definition, so similarly named tables are left alone)
+def drop_indexes(conn, table):
+    marker = f"content={quote_ident(table)}"
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE ? AND instr(sql, ?) > 0",
+                                (FTS_TABLE_PREFIX + "%", marker)).fetchall():
+        conn.execute(f"DROP TABLE IF EXISTS {quote_ident(name)}")
+
+# Called at upload: (re)builds the indexes of a freshly written table
+def build_indexes(db_path, table):
+    conn = sqlite3.connect(db_path)
+    try:
+        drop_indexes(conn, table)
+        built = [create_index(conn, table, column) for column in text_columns(conn, table)]
+        conn.commit()
+    finally:
+        conn.close()
+    if built:
+        print(f"Built full-text indexes for {table}: {', '.join(built)}")
+    return built
+
+# Index for table.column, built on first use for tables that predate indexing at upload.
+# Answers are remembered per table version, so dropped or replaced tables are re-checked.
+def ensure_index(db_path, table, column):
+    key = (db_path, table, column.lower())
+    version = table_version(db_path, table)
+    cached = _checked.get(key)
+    if cached and cached[0] == version:
+        return cached[1]
+    conn = sqlite3.connect(db_path)
+    try:
+        with _lock:
+            name = None
+            match = next((c for c in text_columns(conn, table) if c.lower() == column.lower()), None)
+            if match:
+                name = index_name(table, match)
+                if not _exists(conn, name):
+                    create_index(conn, table, match)
+                    conn.commit()
+                    print(f"Built full-text index {name}")
+            _checked[key] = (version, name)
+    finally:
+        conn.close()
+    return name
+
+def can_use_index(pattern):
+    return any(len(run) >= MIN_TRIGRAM_CHARS for run in re.split(r"[%_]", pattern))
+
+# Ranked keyword search (bm25) over an indexed column
+def search(db_path, table, column, query, limit=20):
+    name = ensure_index(db_path, table, column)
+    if not name:
+        return None
+    terms = [t for t in re.findall(r"\w+", query) if len(t) >= MIN_TRIGRAM_CHARS]
+    if not terms:
+        return []
+    match = " OR ".join('"' + t.replace('"', '""') + '"' for t in terms)
+    idx = quote_ident(name)
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.execute(
+            f"SELECT t.rowid, bm25({idx}) AS score, t.* FROM {idx} JOIN {quote_ident(table)} t ON t.rowid = {idx}.rowid"
+            f" WHERE {idx} MATCH ? ORDER BY score LIMIT ?", (match, limit))
+        columns = [d[0] for d in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+def searchable_columns(db_path, table):
+    conn = sqlite3.connect(db_path)
+    try:
+        return text_columns(conn, table)
+    finally:
+        conn.close()
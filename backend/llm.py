@@ -0,0 +1,195 @@
+import os
+import re
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models import BaseChatModel
+from metrics import metrics
+
+DEFAULT_MODEL = "llama-3.3-70b-versatile"
+# Cheapest first, e.g. LLM_CASCADE="llama-3.1-8b-instant,llama-3.3-70b-versatile"
+LLM_CASCADE = [m.strip() for m in os.getenv("LLM_CASCADE", DEFAULT_MODEL).split(",") if m.strip()]
+# USD per million tokens, e.g. LLM_PRICES="llama-3.1-8b-instant:0.08,llama-3.3-70b-versatile:0.79"
+LLM_PRICES = {
+    model.strip(): float(price)
+    for model, _, price in (p.partition(":") for p in os.getenv("LLM_PRICES", "").split(",") if ":" in p)
+}
+
+# Hedging: a call still running after the LLM_HEDGE_PERCENTILE latency of its model gets a
+# duplicate, first answer wins. At most LLM_HEDGE_MAX_RATE of calls may be hedged.
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_PERCENTILE = int(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MAX_RATE = float(os.getenv("LLM_HEDGE_MAX_RATE", "0.05"))
+LLM_HEDGE_WORKERS = int(os.getenv("LLM_HEDGE_WORKERS", "32"))
+# No hedging until the percentile means something, and never sooner than this
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY_MS = 500
+
+AGENT_FAILURES = ("Agent stopped due to", "Could not parse LLM output", "Invalid Format")
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Sums the token usage reported by every LLM call made with this handler attached
+class UsageTracker(BaseCallbackHandler):
+    def __init__(self):
+        self.tokens = 0
+
+    def on_llm_end(self, response, **kwargs):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage.get("total_tokens"):
+            self.tokens += usage["total_tokens"]
+            return
+        for generations in response.generations:
+            for gen in generations:
+                meta = getattr(getattr(gen, "message", None), "usage_metadata", None) or {}
+                self.tokens += meta.get("total_tokens", 0)
+
+def record_tier_tokens(model, tokens):
+    metrics.incr(f"llm_tokens.{model}", tokens)
+    metrics.incr("llm_cost_usd", tokens * LLM_PRICES.get(model, 0) / 1_000_000)
+
+def record_tier(model, latency_ms, tokens):
+    metrics.observe(f"llm_tier_ms.{model}", latency_ms)
+    record_tier_tokens(model, tokens)
+
+def result_tokens(result):
+    return ((getattr(result, "llm_output", None) or {}).get("token_usage") or {}).get("total_tokens", 0)
+
+class Hedger:
+    def __init__(self):
+        self.calls = 0
+        self.hedges = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=LLM_HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+
+    def threshold_ms(self, model):
+        name = f"llm_call_ms.{model}"
+        if metrics.count(name) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_DELAY_MS, metrics.percentile(name, LLM_HEDGE_PERCENTILE))
+
+    def _take_hedge(self):
+        with self._lock:
+            if self.hedges + 1 > self.calls * LLM_HEDGE_MAX_RATE:
+                return False
+            self.hedges += 1
+            return True
+
+    # Latency saved = how much longer the primary took than the hedge that beat it,
+    # recorded once both have finished (whichever finishes second records it)
+    def _settle(self, state, key, value):
+        with self._lock:
+            state[key] = value
+            if "primary_ms" in state and "won_ms" in state:
+                metrics.observe("llm_hedge_saved_ms", state["primary_ms"] - state["won_ms"])
+
+    # fn is called once, or twice if it is slow; on_discard gets the losing call's result
+    def call(self, model, fn, on_discard=None):
+        with self._lock:
+            self.calls += 1
+        threshold = self.threshold_ms(model) if LLM_HEDGE else None
+        started = time.perf_counter()
+        if threshold is None:
+            result = fn()
+            metrics.observe(f"llm_call_ms.{model}", (time.perf_counter() - started) * 1000)
+            return result
+
+        state = {}
+        def primary_done(future):
+            if future.exception() is None:
+                elapsed = (time.perf_counter() - started) * 1000
+                metrics.observe(f"llm_call_ms.{model}", elapsed)
+                self._settle(state, "primary_ms", elapsed)
+
+        # Pool threads run the call in the caller's context (request deadline)
+        primary = self._pool.submit(contextvars.copy_context().run, fn)
+        primary.add_done_callback(primary_done)
+        # wait(), not result(timeout=): a call that failed fast with a TimeoutError of its own
+        # (DeadlineExceeded) must be raised, not taken for a slow one
+        wait([primary], timeout=threshold / 1000)
+        if primary.done() or not self._take_hedge():
+            return primary.result()
+
+        metrics.incr("llm_hedges")
+        print(f"LLM call to {model} still running after {threshold:.0f} ms, hedging")
+        backup = self._pool.submit(contextvars.copy_context().run, fn)
+        pending, error = {primary, backup}, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                # The loser can't be cancelled mid-request; its tokens are still paid for
+                for loser in pending:
+                    if on_discard:
+                        loser.add_done_callback(lambda f: f.exception() is None and on_discard(f.result()))
+                if future is backup:
+                    metrics.incr("llm_hedge_wins")
+                    self._settle(state, "won_ms", (time.perf_counter() - started) * 1000)
+                return future.result()
+        raise error
+
+hedger = Hedger()
+
+# Chat model that sends its calls through the hedger. Streaming calls are passed straight
+# through: two token streams can't be merged into one callback stream.
+class HedgedChatModel(BaseChatModel):
+    inner: Any
+    model_name: str
+
+    @property
+    def _llm_type(self):
+        return "hedged-" + self.inner._llm_type
+
+    @property
+    def _identifying_params(self):
+        return {"model_name": self.model_name}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if getattr(self.inner, "streaming", False):
+            return self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        return hedger.call(self.model_name, lambda: self.inner._generate(messages, stop=stop, **kwargs), self._discarded)
+
+    def _combine_llm_outputs(self, llm_outputs):
+        return self.inner._combine_llm_outputs(llm_outputs)
+
+    def _discarded(self, result):
+        tokens = result_tokens(result)
+        metrics.incr("llm_hedge_tokens", tokens)
+        record_tier_tokens(self.model_name, tokens)
+
+def _well_typed(columns, rows):
+    for i, _ in enumerate(columns):
+        values = [row[i] for row in rows if row[i] is not None]
+        if not values:
+            return False
+        numeric = sum(isinstance(v, (int, float)) for v in values)
+        if 0 < numeric < len(values):
+            return False
+    return True
+
+# Whether a cheaper tier's result is good enough to return. Returns (ok, reason).
+# A tier that tried to change data is always escalated: writes are left to the final tier.
+def validate_answer(result, question, schema_words, write_blocked=False):
+    if write_blocked:
+        return False, "data change left to the final model"
+    if result.get("partial"):
+        return False, "partial answer"
+    answer = result.get("answer") or ""
+    if any(marker in answer for marker in AGENT_FAILURES):
+        return False, "agent did not finish"
+    if result.get("sql") and result.get("columns") is None:
+        return False, "SQL did not execute"
+    if result.get("columns") is not None:
+        if not result.get("rows"):
+            return False, "empty result"
+        if not _well_typed(result["columns"], result["rows"]):
+            return False, "mixed or empty column types"
+        return True, None
+    # No SQL at all is only trusted for questions that don't mention the data
+    if set(WORD_RE.findall(question.lower())) & schema_words:
+        return False, "answered a data question without SQL"
+    return True, None
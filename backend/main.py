@@ -2,18 +2,42 @@ import os
 import sqlite3
 import pandas as pd
 import io
+import re
+import json
+import hashlib
 import time
-import random
 import traceback
-from fastapi import FastAPI, UploadFile, File, HTTPException, Response
+import queue
+import threading
+from fastapi import FastAPI, UploadFile, File, HTTPException, Response, Request
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from langchain_community.utilities import SQLDatabase
+from typing import Optional
 from langchain_community.agent_toolkits import create_sql_agent
-from langchain_groq import ChatGroq
 from dotenv import load_dotenv
+from metrics import metrics
+from streaming import StreamingHandler, notify, sse
+from singleflight import SingleFlight
+from prompting import assemble_prompt, truncate_to_tokens, PROMPT_TOKEN_BUDGET
+from sessions import SessionStore, TURN_TABLE_PREFIX
+from sql_engine import DataPulseSQLDatabase, NO_SUCH_COLUMN_RE, is_read_only, prepare_sql, run_select, list_tables, materialize_rows, drop_tables, create_value_indexes
+from sql_repair import SQLRepairError
+from sql_guard import running_queries, cancel_query
+from charts import build_chart
+from results import result_store
+from sql_memory import SQLMemory, describe_examples, is_follow_up
+from schemas import schema_fingerprint, tables_with_schema, table_schemas, table_rewritten, quote_ident
+from stats import stats
+from entities import resolve_entities, describe_entities
+from llm import DEFAULT_MODEL, LLM_CASCADE, WORD_RE, HedgedChatModel, UsageTracker, record_tier, validate_answer
+from providers import ProviderPool, PooledChatModel, ShedError, ProviderUnavailableError
+from deadlines import request_deadline, remaining_s, check_deadline, DeadlineExceeded
+from circuit_breaker import CircuitOpenError
+from fts import FTS_TABLE_PREFIX, build_indexes, searchable_columns, search as fulltext_search
 
 load_dotenv(override=True)
+provider_pool = ProviderPool.from_env()
 
 app = FastAPI()
 
@@ -60,6 +84,20 @@ def set_active_table(name):
 def status():
     return {"status": "online", "engine": "DataPulse Neural"}
 
+# "down" while the LLM circuit is open (only memory answers are served), "degraded" while it is
+# probing or every provider backend is rate limited
+@app.get("/health")
+def health():
+    breaker = provider_pool.breaker.snapshot()
+    providers = provider_pool.snapshot()
+    if breaker["state"] == "open":
+        status = "down"
+    elif breaker["state"] == "half_open" or not any(p["available"] for p in providers.values()):
+        status = "degraded"
+    else:
+        status = "ok"
+    return {"status": status, "llm_circuit": breaker, "providers": providers}
+
 @app.post("/upload")
 async def upload_dataset(file: UploadFile = File(...)):
     try:
@@ -74,13 +112,21 @@ async def upload_dataset(file: UploadFile = File(...)):
         conn = get_conn()
         df.to_sql(table_id, conn, if_exists='replace', index=False)
         conn.close()
+        table_rewritten(DB_PATH, table_id)
+        build_indexes(DB_PATH, table_id)
+        # Categorical values are indexed up front for entity resolution in questions
+        create_value_indexes(DB_PATH, table_id, list(stats.categorical_values(DB_PATH, table_id)))
         
         set_active_table(table_id)
+        fingerprint = schema_fingerprint(DB_PATH, table_id)
         
         return {
             "message": "Dataset indexed",
             "columns": df.columns.tolist(),
-            "table": table_id
+            "table": table_id,
+            "schema_fingerprint": fingerprint,
+            # Learned SQL and schema summaries from these tables apply to this one too
+            "shares_schema_with": [t for t in tables_with_schema(DB_PATH, fingerprint) if t != table_id]
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -88,117 +134,535 @@ async def upload_dataset(file: UploadFile = File(...)):
 class Query(BaseModel):
     question: str
     history: list = []  
+    mode: str = "agent"  # "agent" (ReAct loop) or "single_shot" (one LLM call, local execution)
+    session_id: Optional[str] = None  # server-side history; takes over from `history` when that is empty
+    chart_format: str = "rows"  # "rows" (list of objects) or "columnar" (one encoded array per axis)
+    deadline_ms: Optional[int] = None  # overrides REQUEST_DEADLINE_MS for this request
+
+AGENT_MAX_ITERATIONS = int(os.getenv("AGENT_MAX_ITERATIONS", "15"))
+# Ending of the reply the instructions ask for before any data change
+CONFIRMATION_PROMPT = "Do you want to proceed?"
+SQL_BLOCK_RE = re.compile(r"```sql\s*([\s\S]*?)```", re.IGNORECASE)
+MAX_ANSWER_ROWS = 20
+
+def get_llm(streaming=False, model=DEFAULT_MODEL):
+    return HedgedChatModel(inner=PooledChatModel(pool=provider_pool, model_name=model, streaming=streaming), model_name=model)
+
+def build_instructions(active_table, context_str):
+    return (
+        f"\n\nYou are the DataPulse Neural Engine. "
+        f"\nActive table: '{active_table}'. "
+        f"{context_str}"
+        "\n\nRULES:"
+        "\n1. Charts are drawn automatically from the rows of your LAST SQL query. NEVER write chart data or JSON in your answer."
+        "\n2. For charts, make your last query return the category/x column first and the numeric y column second, then give a short summary."
+        f"\n3. You have permission to INSERT/UPDATE/DELETE records on '{active_table}' IF:"
+        "\n   - The user explicitly confirms in the conversation (e.g. 'yes', 'proceed', 'do it')."
+        "\n   - OR The 'PREVIOUS CONVERSATION' shows the Assistant asked for confirmation and the User answered 'yes'."
+        "\n   - If permission is granted, GENERATE the SQL and EXECUTE it."
+        "\n   - If NO valid confirmation is found, DO NOT execute. Instead, use 'Final Answer' to return: '⚠️ I am about to [action]. Do you want to proceed?'"
+        "\n   - NEVER output 'Action: None'. If you don't need to use a tool, use 'Final Answer'."
+        "\n4. ALWAYS append the generated SQL query at the very end of your response in a markdown block like this:\n```sql\nSELECT ...\n```"
+        "\n5. CLASSIFICATION RULE:"
+        "\n   - DATA OPERATION (e.g., 'trends', 'plot', 'insert', 'add', 'update', 'delete', 'modify', 'count'): Generate SQL to query or modify the database."
+        "\n     * If the user asks to insert/update but details are ambiguous, ask for the specific values using 'Final Answer'."
+        "\n   - GENERAL QUERY (e.g., 'what is python?', 'tell me a joke', 'general advice'): Answer directly based on your knowledge. DO NOT generate SQL."
+        "\n   ### 🧠 Critical Analysis & Reasoning Steps"
+        "\nBefore answering, you must ALWAYS perform these steps:"
+        "\n1.  Understand**: Identify what the user is asking."
+        "\n2.  **Schema Check**: Look at the table structure. Do the columns match the user's terms?"
+        "\n3.  **Plan**: Decide the SQL query."
+        "\n    - If logic is complex, break it down."
+        "\n    - ALWAYS use `LIKE` for string matching (e.g. `Name LIKE '%John%'`) if exact match is unsure."
+        "\n    - Handle `NULL`: Use `COALESCE` or exclude nulls if needed."
+        "\n4.  **Execute**: Run the SQL."
+        "\n5.  **Verify**: Does the output make sense?"
+    )
+
+def build_single_shot_prompt(active_table, table_info, context_str, question):
+    return (
+        "You are the DataPulse Neural Engine, an expert SQLite analyst."
+        f"\nActive table: '{active_table}'."
+        f"\n\nSCHEMA:\n{table_info}"
+        f"{context_str}"
+        "\n\nRULES:"
+        "\n1. If the question needs data, reply with exactly ONE SQLite query inside a ```sql ... ``` block and nothing else."
+        "\n2. If the question is general (e.g. 'what is python?'), answer it directly in plain text WITHOUT any SQL."
+        "\n3. Only use tables and columns that appear in SCHEMA."
+        "\n4. Use `LIKE` for string matching (e.g. `Name LIKE '%John%'`) if exact match is unsure. Handle `NULL` with `COALESCE` if needed."
+        "\n5. For charts or trends, select exactly two columns: the category/x value first, the numeric value second."
+        f"\n\nQUESTION: {question.strip()}"
+    )
+
+def extract_sql(text):
+    match = SQL_BLOCK_RE.search(text or "")
+    return match.group(1).strip().rstrip(";").strip() if match else None
+
+def format_result_answer(columns, rows, sql, truncated=False):
+    if not rows:
+        body = "The query returned no matching records."
+    elif len(rows) == 1 and len(columns) == 1:
+        body = f"**{columns[0]}:** {rows[0][0]}"
+    else:
+        shown = rows[:MAX_ANSWER_ROWS]
+        body = "| " + " | ".join(columns) + " |\n|" + "---|" * len(columns) + "\n"
+        body += "\n".join("| " + " | ".join("" if v is None else str(v) for v in row) + " |" for row in shown)
+        if len(rows) > len(shown):
+            body += f"\n\n_Showing {len(shown)} of {len(rows)} rows._"
+    if truncated:
+        body += f"\n\n_The result was cut off after {len(rows)} rows; totals over these rows may be incomplete._"
+
+    return f"{body}\n\n```sql\n{sql}\n```"
+
+class SQLExecutionError(Exception):
+    def __init__(self, sql, error):
+        super().__init__(str(error))
+        self.sql = sql
+
+def build_agent_input(question, active_table, context_str, failed_attempt=None):
+    input_text = question + build_instructions(active_table, context_str)
+    if failed_attempt:
+        sql, err = failed_attempt
+        input_text += f"\n\nNOTE: A previous attempt ran this SQL and it failed, do not repeat the mistake:\n```sql\n{sql}\n```\nError: {err}"
+    return input_text
+
+def run_agent(llm, db_engine, input_text, callbacks=None):
+    agent = create_sql_agent(
+        llm=llm,
+        db=db_engine,
+        agent_type="zero-shot-react-description",
+        verbose=False,
+        handle_parsing_errors="Check your output and make sure it conforms, do not output Action: None. If you need to stop or ask a question, use 'Final Answer'.",
+        max_iterations=AGENT_MAX_ITERATIONS,
+        max_execution_time=remaining_s(),
+    )
+
+    response = agent.invoke({"input": input_text}, config={"callbacks": callbacks})
+    if response["output"].startswith("Agent stopped due to"):
+        check_deadline("agent")
+        return partial_result(db_engine, "the agent step budget")
+    result = {"answer": response["output"], "sql": extract_sql(response["output"]), "columns": None, "rows": None}
+    if db_engine.last_result:
+        sql, result["columns"], result["rows"], result["truncated"] = db_engine.last_result
+        result["sql"] = result["sql"] or sql
+        result["result_id"] = db_engine.last_handle
+        # Only worth remembering when it is the SQL the answer reports (a write or another
+        # query in the answer means the last SELECT was just a step on the way)
+        reported = extract_sql(response["output"])
+        if reported is None or " ".join(reported.split()) == " ".join(db_engine.last_query.split()):
+            result["executed_sql"] = sql
+    return result
+
+# Best answer available when time or steps run out: the last result the agent got, if any
+def partial_result(db_engine, reason):
+    if not db_engine.last_result:
+        return {"answer": f"I could not finish this analysis before {reason} ran out. Try a narrower question or a longer deadline.",
+                "sql": None, "columns": None, "rows": None, "prompt_tokens": 0, "partial": True}
+    sql, columns, rows, truncated = db_engine.last_result
+    note = f"_(Partial answer: {reason} ran out before the analysis was finished.)_"
+    return {"answer": f"{format_result_answer(columns, rows, sql, truncated)}\n\n{note}", "sql": sql, "columns": columns, "rows": rows, "truncated": truncated,
+            "result_id": db_engine.last_handle, "prompt_tokens": 0, "partial": True}
+
+# Earlier turns' results are kept as small tables so follow-ups can filter or re-aggregate them
+def describe_turn_tables(turn_tables):
+    if not turn_tables:
+        return ""
+    lines = "\n".join(
+        f"- {t['table']} ({t['rows']} rows; columns: {', '.join(t['columns'])}) = result of: {' '.join(t['sql'].split())}"
+        for t in turn_tables
+    )
+    return (
+        "\n\nPREVIOUS RESULTS (tables holding the results of earlier answers in this conversation):\n"
+        f"{lines}\n"
+        "For follow-ups on these results (filter, break down, re-aggregate), query these tables instead of recomputing from the base table."
+    )
+
+# One LLM call writes the SQL, we execute it locally and format the answer ourselves.
+# Returns None when the request needs the agent (writes, confirmations), raises on SQL errors.
+def run_single_shot(llm, db_engine, active_table, question, history, summary=None, callbacks=None, turn_tables=None, extra_context=""):
+    # The schema (with sample rows) may take at most 40% of the budget, history gets what is left
+    table_info = truncate_to_tokens(db_engine.get_table_info([active_table]), int(PROMPT_TOKEN_BUDGET * 0.4))
+    results_str = extra_context + describe_turn_tables(turn_tables)
+    prompt, prompt_tokens = assemble_prompt(lambda ctx: build_single_shot_prompt(active_table, table_info, results_str + ctx, question), history, summary=summary)
+    reply = llm.invoke(prompt, config={"callbacks": callbacks}).content
+
+    sql = extract_sql(reply)
+    if sql is None:
+        return {"answer": reply, "sql": None, "columns": None, "rows": None, "prompt_tokens": prompt_tokens}
+    if not is_read_only(sql):
+        return None
+
+    # Misspelled columns, MySQL functions and missing LIMITs are fixed here without another LLM call
+    try:
+        sql, _ = prepare_sql(db_engine.db_path, sql, db_engine.get_usable_table_names(), active_table)
+    except SQLRepairError as e:
+        raise SQLExecutionError(e.sql, e)
+
+    notify(callbacks, {"type": "sql", "sql": sql})
+    try:
+        columns, rows, truncated = run_select(db_engine.db_path, sql)
+    except sqlite3.Error as e:
+        check_deadline("sql")
+        raise SQLExecutionError(sql, e)
+    notify(callbacks, {"type": "rows", "rows": len(rows)})
+    return {"answer": format_result_answer(columns, rows, sql, truncated), "sql": sql, "columns": columns, "rows": rows, "truncated": truncated,
+            "result_id": result_store.put(sql, columns, rows), "prompt_tokens": prompt_tokens, "executed_sql": sql}
+
+# Near-exact repeat of a question we already answered: run its validated SQL, no LLM call.
+# Returns None if the stored SQL no longer runs (the caller then generates SQL as usual)
+def run_memory_sql(db_engine, sql, callbacks=None):
+    notify(callbacks, {"type": "sql", "sql": sql})
+    try:
+        columns, rows, truncated = run_select(db_engine.db_path, sql)
+    except sqlite3.Error as e:
+        print(f"Stored SQL failed ({e}), generating a new query.")
+        return None
+    notify(callbacks, {"type": "rows", "rows": len(rows)})
+    return {"answer": format_result_answer(columns, rows, sql, truncated), "sql": sql, "columns": columns, "rows": rows, "truncated": truncated,
+            "result_id": result_store.put(sql, columns, rows), "prompt_tokens": 0}
+
+# Only SQL that ran and returned rows for a self-contained question is worth remembering
+def remember_sql(fingerprint, active_table, question, sql, rows, latency_ms):
+    if not sql or not rows or not is_read_only(sql) or TURN_TABLE_PREFIX in sql or is_follow_up(question):
+        return
+    try:
+        sql_memory.record(fingerprint, active_table, question, sql, latency_ms)
+    except sqlite3.Error as e:
+        print(f"Could not store SQL in memory: {e}")
+
+inflight = SingleFlight()
+sql_memory = SQLMemory()
+sessions = SessionStore(on_drop_tables=lambda tables: drop_tables(DB_PATH, tables))
+TURN_TABLE_MAX_ROWS = int(os.getenv("TURN_TABLE_MAX_ROWS", "100000"))
+
+# Turn tables belong to in-memory sessions, so none survive a restart
+@app.on_event("startup")
+def drop_stale_turn_tables():
+    if os.path.exists(DB_PATH):
+        drop_tables(DB_PATH, list_tables(DB_PATH, TURN_TABLE_PREFIX))
+
+# Requests with the same key produce the same answer, so concurrent duplicates can share one run
+def cache_key(request, summary=None, turn_tables=None):
+    payload = {
+        "question": " ".join(request.question.lower().split()),
+        "mode": request.mode,
+        "chart_format": request.chart_format,
+        # get_active_table() would create the database, hiding the no-dataset branch of answer_query
+        "table": get_active_table() if os.path.exists(DB_PATH) else None,
+        "history": [(m.get("role"), m.get("content")) for m in request.history[-6:]],
+        "summary": summary or [],
+        # Follow-ups are answered against the session's own result tables
+        "turn_tables": [(t["table"], t["sql"]) for t in turn_tables or []],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+def error_answer(e):
+    if isinstance(e, CircuitOpenError):
+        return {"answer": "⚡ **Engine Offline:** The AI provider is not responding right now, so only previously answered questions can be served. Please try again shortly.",
+                "retry_after_s": round(e.retry_in, 1)}
+    if isinstance(e, ProviderUnavailableError):
+        return {"answer": "🛠️ **Engine Recovering:** The AI provider just returned errors, so it gets a short break. Please retry in a few seconds.",
+                "retry_after_s": round(e.retry_in, 1)}
+    if getattr(e, "status_code", None) == 429:
+        retry_in = getattr(e, "retry_in", None)
+        return {"answer": "🚀 **Engine Heat:** Too many requests. I tried to cool down but the pulse is still unstable. Please wait a minute.",
+                "retry_after_s": round(retry_in, 1) if retry_in is not None else None}
+    if isinstance(e, TimeoutError):
+        return {"answer": "⏱️ **Out of Time:** I could not answer within the request's deadline. Try a narrower question or a longer deadline.", "partial": True}
+    return {"answer": f"The neural engine encountered a ripple. Please retry your query. (Error: {str(e)})"}
+
+# Legacy clients still send their full history; everyone else gets it from the session store
+def resolve_conversation(request):
+    session = sessions.get_or_create(request.session_id)
+    turns, summary = sessions.snapshot(session)
+    if request.history:
+        return request, session, []
+    return request.model_copy(update={"history": turns}), session, summary
+
+def record_turn(session, question, result):
+    sessions.append(session, "user", question)
+    sessions.append(session, "ai", result.get("answer", ""))
+    entry = result_store.get(result["result_id"]) if result.get("result_id") else None
+    if entry and 0 < len(entry[2]) <= TURN_TABLE_MAX_ROWS and os.path.exists(DB_PATH):
+        sql, columns, rows = entry
+        table = sessions.next_turn_table(session)
+        try:
+            materialize_rows(DB_PATH, table, columns, rows)
+            sessions.add_turn_table(session, {"table": table, "sql": sql, "columns": columns, "rows": len(rows)})
+        except sqlite3.Error as e:
+            print(f"Could not materialise {table}: {e}")
+    return {**result, "session_id": session.id}
+
+# Arrival time, so the deadline also covers time spent waiting for a worker thread
+@app.middleware("http")
+async def stamp_arrival(http_request: Request, call_next):
+    http_request.state.received_at = time.monotonic()
+    return await call_next(http_request)
 
 @app.post("/ask")
-def process_query(request: Query):
+def process_query(request: Query, http_request: Request):
+    started = time.perf_counter()
+    request, session, summary = resolve_conversation(request)
+    try:
+        turn_tables = sessions.turn_tables(session)
+        with request_deadline(request.deadline_ms, http_request.state.received_at):
+            check_deadline("queue")
+            result, shared = inflight.do(cache_key(request, summary, turn_tables), lambda: answer_query(request, summary=summary, turn_tables=turn_tables), timeout=remaining_s())
+    except Exception as e:
+        if not isinstance(e, (CircuitOpenError, ShedError, TimeoutError)):
+            traceback.print_exc()
+        return {**error_answer(e), "session_id": session.id}
+
+    if shared:
+        metrics.incr("ask_coalesced")
+        result = {**result, "coalesced": True}
+    metrics.observe("ask_latency_ms", (time.perf_counter() - started) * 1000)
+    return record_turn(session, request.question, result)
+
+# Same pipeline as /ask, sent as server-sent events: "step" (generated SQL, rows returned),
+# "token" (answer text as it arrives), then "done" with the full /ask payload.
+@app.post("/ask/stream")
+def stream_query(request: Query, http_request: Request):
+    started = time.perf_counter()
+    received_at = http_request.state.received_at
+    events = queue.Queue()
+    handler = StreamingHandler(events)
+    request, session, summary = resolve_conversation(request)
+
+    def worker():
+        try:
+            turn_tables = sessions.turn_tables(session)
+            with request_deadline(request.deadline_ms, received_at):
+                check_deadline("queue")
+                # Identical questions in flight share one run; a follower gets no step or token
+                # events, only the final answer (sent as one token by event_stream)
+                result, shared = inflight.do(cache_key(request, summary, turn_tables),
+                                             lambda: answer_query(request, callbacks=[handler], summary=summary, turn_tables=turn_tables),
+                                             timeout=remaining_s())
+            if shared:
+                metrics.incr("ask_coalesced")
+                result = {**result, "coalesced": True}
+            events.put(("done", record_turn(session, request.question, result)))
+        except Exception as e:
+            if not isinstance(e, (CircuitOpenError, ShedError, TimeoutError)):
+                traceback.print_exc()
+            events.put(("error", {**error_answer(e), "session_id": session.id}))
+        finally:
+            events.put(None)
+
+    threading.Thread(target=worker, daemon=True).start()
+
+    def event_stream():
+        first_byte = first_token = None
+        while True:
+            item = events.get()
+            if item is None:
+                break
+            event, data = item
+            if event == "done" and not handler.streamed_tokens:
+                # Nothing was streamed (greeting, single-shot, cached...): send the answer as one token
+                yield sse("token", {"text": data.get("answer", "")})
+            if first_byte is None:
+                first_byte = (time.perf_counter() - started) * 1000
+                metrics.observe("ask_stream_ttfb_ms", first_byte)
+            if first_token is None and event in ("token", "done"):
+                first_token = (time.perf_counter() - started) * 1000
+                metrics.observe("ask_stream_first_token_ms", first_token)
+            if event == "done":
+                data = {**data, "ttfb_ms": round(first_byte, 1)}
+            yield sse(event, data)
+        metrics.observe("ask_stream_latency_ms", (time.perf_counter() - started) * 1000)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/metrics")
+def get_metrics():
+    snapshot = metrics.snapshot()
+    cascaded = snapshot["counters"].get("cascade_requests", 0)
+    escalation_rate = round(snapshot["counters"].get("cascade_escalations", 0) / cascaded, 3) if cascaded else None
+    return {**snapshot, "sessions": len(sessions), "escalation_rate": escalation_rate, "providers": provider_pool.snapshot()}
+
+# Single-shot (when requested) with fallback to the agent, on one model
+def generate_answer(llm, db_engine, request, callbacks, summary, turn_tables, extra_context):
+    active_table = db_engine.active_table
+    mode = "agent"
+    failed_attempt = None
+    result = None
+    if request.mode == "single_shot":
+        mode = "single_shot"
+        for attempt in range(2):
+            try:
+                result = run_single_shot(llm, db_engine, active_table, request.question, request.history, summary, callbacks, turn_tables, extra_context)
+                break
+            except SQLExecutionError as e:
+                # A column the model could not see: widen the described set and try once more
+                missing = NO_SUCH_COLUMN_RE.search(str(e))
+                if attempt == 0 and missing and db_engine.widen_focus(missing.group(1)):
+                    continue
+                # Only an execution error hands the question over to the agent loop
+                failed_attempt = (e.sql, str(e))
+                print(f"Single-shot SQL failed ({e}). Falling back to agent.")
+                break
+        if result is None:
+            mode = "single_shot_fallback"
+
+    if result is None:
+        results_str = extra_context + describe_turn_tables(turn_tables)
+        input_text, prompt_tokens = assemble_prompt(lambda ctx: build_agent_input(request.question, active_table, results_str + ctx, failed_attempt), request.history, summary=summary)
+        result = run_agent(llm, db_engine, input_text, callbacks)
+        result["prompt_tokens"] = prompt_tokens
+    return result, mode
+
+# Models in LLM_CASCADE are tried cheapest first. A cheaper tier's answer is kept only if it
+# passes validate_answer(); otherwise (or if it raised) the question goes to the next tier.
+# Only the last tier streams tokens, so a rejected answer is never shown to the user, and
+# only the last tier may change data: a write is never left to an unvalidated model.
+def run_cascade(db_engine, request, callbacks, summary, turn_tables, extra_context):
+    schema = table_schemas(DB_PATH).get(db_engine.active_table, {})
+    schema_words = {w for name, _ in schema.get("columns", []) for w in WORD_RE.findall(name.lower()) if len(w) > 2}
+    if len(LLM_CASCADE) > 1:
+        metrics.incr("cascade_requests")
+    for tier, model in enumerate(LLM_CASCADE):
+        final = tier == len(LLM_CASCADE) - 1
+        llm = get_llm(streaming=bool(callbacks) and final, model=model)
+        usage = UsageTracker()
+        db_engine.last_result = db_engine.last_handle = None
+        db_engine.allow_writes, db_engine.write_blocked = final, False
+        tier_started = time.perf_counter()
+        try:
+            result, mode = generate_answer(llm, db_engine, request, (callbacks or []) + [usage], summary, turn_tables, extra_context)
+            error = None
+        except Exception as e:
+            # A failed run that already changed the data must not be repeated, nor one out of time
+            if final or db_engine.wrote or isinstance(e, DeadlineExceeded):
+                raise
+            result, error = None, e
+        finally:
+            record_tier(model, (time.perf_counter() - tier_started) * 1000, usage.tokens)
+        if final:
+            break
+        ok, reason = validate_answer(result, request.question, schema_words, db_engine.write_blocked) if result else (False, f"error: {error}")
+        # With no time left a doubtful answer still beats none
+        if ok or remaining_s() is not None and remaining_s() <= 0:
+            if result is None:
+                raise error
+            break
+        metrics.incr("cascade_escalations")
+        print(f"Escalating from {model} to {LLM_CASCADE[tier + 1]}: {reason}")
+        notify(callbacks, {"type": "escalate", "model": LLM_CASCADE[tier + 1], "reason": reason})
+    result["model"] = model
+    return result, mode
+
+def answer_query(request, callbacks=None, summary=None, turn_tables=None):
     # 1. Handle Greetings
     greetings = ["hi", "hello", "hey", "greetings", "good morning", "good afternoon", "good evening"]
     if request.question.strip().lower() in greetings:
         return {"answer": "Hello! 👋 I'm DataPulse AI. Please upload a CSV dataset so I can assist you with comprehensive data analysis. Ready when you are!"}
 
-    key = os.getenv("GROQ_API_KEY")
-    if not key:
+    if not provider_pool.backends:
         return {"answer": "Missing API configuration."}
 
-    llm = ChatGroq(
-        model="llama-3.3-70b-versatile",
-        temperature=0,
-        api_key=key
-    )
-
     # 2. Check Dataset
     if not os.path.exists(DB_PATH):
         # Fallback to general chat if no dataset
         try:
-            response = llm.invoke(request.question)
+            response = get_llm(model=LLM_CASCADE[0]).invoke(request.question)
             return {"answer": response.content + "\n\n_(Please upload a CSV file to unlock data analysis capabilities)_"}
         except Exception as e:
              return {"answer": "I'm ready to analyze your data. Please upload a CSV file to get started."}
 
-    # 3. Dataset Exists - Use SQL Agent
-    try:
-        active_table = get_active_table()
-        db_engine = SQLDatabase.from_uri(f"sqlite:///{DB_PATH}")
-        
-        llm = ChatGroq(
-            model="llama-3.3-70b-versatile",
-            temperature=0,
-            api_key=key
-        )
-
-        agent = create_sql_agent(
-            llm=llm,
-            db=db_engine,
-            agent_type="zero-shot-react-description",
-            verbose=False,
-            handle_parsing_errors="Check your output and make sure it conforms, do not output Action: None. If you need to stop or ask a question, use 'Final Answer'.",
-        )
-
-        # Build context from history
-        context_str = ""
-        if request.history:
-            context_str = "\n\nPREVIOUS CONVERSATION:\n"
-            for msg in request.history[-6:]: 
-                role = "User" if msg['role'] == 'user' else "Assistant"
-                context_str += f"{role}: {msg['content']}\n"
-            
-            instructions = (
-            f"\n\nYou are the DataPulse Neural Engine. "
-            f"\nActive table: '{active_table}'. "
-            f"{context_str}"
-            "\n\nRULES:"
-            "\n1. For charts, provide a summary then JSON inside ```json ... ``` blocks."
-            "\n2. JSON Format: {\"type\": \"chart\", \"chartType\": \"bar|line|pie|area\", \"data\": [...], \"xAxis\": \"col\", \"yAxis\": \"col\", \"title\": \"text\"}."
-            f"\n3. You have permission to INSERT/UPDATE/DELETE records on '{active_table}' IF:"
-            "\n   - The user explicitly confirms in the conversation (e.g. 'yes', 'proceed', 'do it')."
-            "\n   - OR The 'PREVIOUS CONVERSATION' shows the Assistant asked for confirmation and the User answered 'yes'."
-            "\n   - If permission is granted, GENERATE the SQL and EXECUTE it."
-            "\n   - If NO valid confirmation is found, DO NOT execute. Instead, use 'Final Answer' to return: '⚠️ I am about to [action]. Do you want to proceed?'"
-            "\n   - NEVER output 'Action: None'. If you don't need to use a tool, use 'Final Answer'."
-            "\n4. ALWAYS append the generated SQL query at the very end of your response in a markdown block like this:\n```sql\nSELECT ...\n```"
-            "\n5. CLASSIFICATION RULE:"
-            "\n   - DATA OPERATION (e.g., 'trends', 'plot', 'insert', 'add', 'update', 'delete', 'modify', 'count'): Generate SQL to query or modify the database."
-            "\n     * If the user asks to insert/update but details are ambiguous, ask for the specific values using 'Final Answer'."
-            "\n   - GENERAL QUERY (e.g., 'what is python?', 'tell me a joke', 'general advice'): Answer directly based on your knowledge. DO NOT generate SQL."
-            "\n   ### 🧠 Critical Analysis & Reasoning Steps"
-            "\nBefore answering, you must ALWAYS perform these steps:"
-            "\n1.  Understand**: Identify what the user is asking."
-            "\n2.  **Schema Check**: Look at the table structure. Do the columns match the user's terms?"
-            "\n3.  **Plan**: Decide the SQL query."
-            "\n    - If logic is complex, break it down."
-            "\n    - ALWAYS use `LIKE` for string matching (e.g. `Name LIKE '%John%'`) if exact match is unsure."
-            "\n    - Handle `NULL`: Use `COALESCE` or exclude nulls if needed."
-            "\n4.  **Execute**: Run the SQL."
-            "\n5.  **Verify**: Does the output make sense?"
-        )
-
-        max_retries = 3
-        base_delay = 2
-
-        for attempt in range(max_retries):
-            try:
-                # FORCE chart generation if keywords are present
-                input_text = request.question + instructions
-                if any(kw in request.question.lower() for kw in ["plot", "graph", "chart", "visualize", "show me"]):
-                    input_text += "\n\nCRITICAL: The user wants a visualization. You MUST generate the JSON chart object. Fetch the data using SQL, then format it as JSON in your Final Answer."
-
-                response = agent.invoke({"input": input_text})
-                result = response["output"]
-                return {"answer": result}
-            except Exception as e:
-                if ("rate_limit" in str(e) or "429" in str(e)) and attempt < max_retries - 1:
-                    sleep_time = base_delay * (2 ** attempt) + random.uniform(0, 1)
-                    print(f"Rate limit hit. Retrying in {sleep_time:.2f}s...")
-                    time.sleep(sleep_time)
-                else:
-                    raise e
+    # 3. Dataset Exists - Use SQL Agent (or single-shot generation when requested)
+    # Errors propagate so a coalesced follower can take over; callers turn them into error_answer()
+    started = time.perf_counter()
+    active_table = get_active_table()
+    # Other sessions' turn tables stay invisible to this agent
+    own_tables = {t["table"] for t in turn_tables or []}
+    foreign_tables = [t for t in list_tables(DB_PATH, TURN_TABLE_PREFIX) if t not in own_tables]
+    # Full-text indexes are used by the optimizer, the agent never needs to see them
+    foreign_tables += list_tables(DB_PATH, FTS_TABLE_PREFIX)
+    db_engine = DataPulseSQLDatabase.from_uri(f"sqlite:///{DB_PATH}", ignore_tables=foreign_tables, lazy_table_reflection=True)
+    db_engine.active_table = active_table
 
-    except Exception as e:
-        traceback.print_exc() 
-        raw_err = str(e)
-        if "rate_limit" in raw_err or "429" in raw_err:
-            return {"answer": "🚀 **Engine Heat:** Too many requests. I tried to cool down but the pulse is still unstable. Please wait a minute."}
-        return {"answer": f"The neural engine encountered a ripple. Please retry your query. (Error: {str(e)})"}
+    mode = "agent"
+    result = None
+    fingerprint = schema_fingerprint(DB_PATH, active_table)
+    matches, entities = [], []
+    # No lookups against an active table that does not exist (yet): nothing was uploaded
+    if fingerprint:
+        matches = sql_memory.search(fingerprint, active_table, request.question)
+        if matches and matches[0][1]:
+            result = run_memory_sql(db_engine, matches[0][2]["sql"], callbacks)
+            if result:
+                mode = "memory"
+                sql_memory.mark_used(fingerprint, matches[0][2]["source_table"], matches[0][2]["normalized"])
+        # Close (but not identical) questions become few-shot examples for the generator, and
+        # words naming values of categorical columns are resolved to the exact stored values
+        entities = resolve_entities(request.question, stats.categorical_values(DB_PATH, active_table))
+        # Wide tables are described by their most relevant columns only
+        db_engine.focus_columns(active_table, request.question, [e[1] for e in entities])
+    extra_context = describe_examples(matches) + describe_entities(entities)
+
+    if result is None:
+        try:
+            result, mode = run_cascade(db_engine, request, callbacks, summary, turn_tables, extra_context)
+        except DeadlineExceeded as e:
+            result, mode = partial_result(db_engine, "the time budget"), "deadline"
+            print(f"Returning a partial answer: {e}")
+
+    metrics.observe("prompt_tokens", result["prompt_tokens"])
+    # The chart comes from the captured result set; the raw rows never leave the server
+    columns, rows = result.pop("columns"), result.pop("rows")
+    if columns:
+        result["chart"] = build_chart(request.question, columns, rows, chart_format=request.chart_format)
+    result["mode"] = mode
+    result["partial"] = result.get("partial", False)
+    # Rows were cut off (row cap or the added LIMIT), so the answer may not cover all data
+    result["truncated"] = result.get("truncated", False)
+    result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    executed_sql = result.pop("executed_sql", None)
+    # A turn that changed data, or only asked to confirm a change, must never be replayed as a read
+    changes_data = db_engine.wrote or db_engine.write_blocked or CONFIRMATION_PROMPT in (result.get("answer") or "")
+    if mode != "memory" and fingerprint and not changes_data:
+        remember_sql(fingerprint, active_table, request.question, executed_sql, rows, result["latency_ms"])
+    return result
+
+# SQL statements currently running, and cancelling one (interrupts it at the next VM step)
+@app.get("/queries")
+def list_queries():
+    return {"queries": running_queries()}
+
+@app.delete("/queries/{query_id}")
+def cancel_running_query(query_id: str):
+    if not cancel_query(query_id):
+        raise HTTPException(status_code=404, detail="Query finished or unknown")
+    return {"cancelled": query_id}
+
+# Full result set behind a result_id, for exports of rows the LLM only saw summarised
+@app.get("/results/{result_id}")
+def export_result(result_id: str):
+    entry = result_store.get(result_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Result expired or unknown")
+
+    sql, columns, rows = entry
+    buffer = io.StringIO()
+    pd.DataFrame.from_records(rows, columns=columns).to_csv(buffer, index=False)
+    resp = Response(content=buffer.getvalue(), media_type="text/csv")
+    resp.headers["Content-Disposition"] = f"attachment; filename={result_id}.csv"
+    return resp
+
+# Ranked (bm25) keyword search over a long text column, e.g. /search?q=free+prize
+@app.get("/search")
+def search_text(q: str, table: Optional[str] = None, column: Optional[str] = None, limit: int = 20):
+    table = table or get_active_table()
+    if table not in list_tables(DB_PATH):
+        raise HTTPException(status_code=404, detail=f"Unknown table '{table}'")
+    columns = searchable_columns(DB_PATH, table)
+    column = column or (columns[0] if columns else None)
+    matches = fulltext_search(DB_PATH, table, column, q, min(limit, 200)) if column else None
+    if matches is None:
+        raise HTTPException(status_code=404, detail=f"No full-text index available for '{table}'")
+    return {"table": table, "column": column, "results": matches}
 
 @app.get("/download")
 def export_data():
@@ -208,7 +672,7 @@ def export_data():
     try:
         table = get_active_table()
         conn = get_conn()
-        df = pd.read_sql_query(f"SELECT * FROM {table}", conn)
+        df = pd.read_sql_query(f"SELECT * FROM {quote_ident(table)}", conn)
         conn.close()
         
         buffer = io.StringIO()
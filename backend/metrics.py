@@ -0,0 +1,48 @@
+import threading
+from collections import defaultdict, deque
+
+def _pick(values, q):
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+# In-process counters and latency samples, exposed on GET /metrics
+class Metrics:
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._counters = defaultdict(float)
+
+    def observe(self, name, value):
+        with self._lock:
+            self._samples[name].append(float(value))
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def count(self, name):
+        with self._lock:
+            return len(self._samples.get(name, ()))
+
+    def percentile(self, name, q):
+        with self._lock:
+            values = sorted(self._samples.get(name, ()))
+        return _pick(values, q) if values else None
+
+    def snapshot(self):
+        with self._lock:
+            samples = {k: sorted(v) for k, v in self._samples.items() if v}
+            counters = dict(self._counters)
+
+        timings = {
+            name: {
+                "count": len(values),
+                "p50": round(_pick(values, 50), 2),
+                "p95": round(_pick(values, 95), 2),
+                "p99": round(_pick(values, 99), 2),
+                "max": round(values[-1], 2),
+            }
+            for name, values in samples.items()
+        }
+        return {"counters": counters, "timings": timings}
+
+metrics = Metrics()
@@ -0,0 +1,117 @@
+import os
+import re
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+MAX_VERBATIM_TURNS = 6
+SUMMARY_TURN_TOKENS = 40
+
+TOKEN_RE = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+CODE_BLOCK_RE = re.compile(r"```(\w*)\s*([\s\S]*?)```")
+INLINE_CHART_RE = re.compile(r"\{\s*[\"']type[\"']\s*:\s*[\"']chart[\"']")
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+
+# Local estimate of the model's token count (no tokenizer download): long words are
+# split roughly every four characters, digits and punctuation count on their own.
+def count_tokens(text):
+    return sum(max(1, (len(piece) + 3) // 4) for piece in TOKEN_RE.findall(text or ""))
+
+def truncate_to_tokens(text, budget):
+    used = 0
+    for match in TOKEN_RE.finditer(text or ""):
+        used += max(1, (len(match.group()) + 3) // 4)
+        if used > budget:
+            return text[:match.start()].rstrip() + "..."
+    return text
+
+# Chart JSON from earlier answers is only noise for the model; keep a short marker instead
+def strip_chart_payloads(text):
+    def replace_block(match):
+        lang, body = match.group(1).lower(), match.group(2)
+        if lang == "json" or '"chart"' in body or "'chart'" in body:
+            title = re.search(r"[\"']title[\"']\s*:\s*[\"']([^\"']*)", body)
+            return f"[chart: {title.group(1)}]" if title else "[chart]"
+        return match.group(0)
+
+    text = CODE_BLOCK_RE.sub(replace_block, text or "")
+    out, pos = [], 0
+    while True:
+        match = INLINE_CHART_RE.search(text, pos)
+        if not match:
+            break
+        out.append(text[pos:match.start()] + "[chart]")
+        pos = _object_end(text, match.start())
+    out.append(text[pos:])
+    return "".join(out).strip()
+
+def _object_end(text, start):
+    depth, quote = 0, None
+    for i in range(start, len(text)):
+        c = text[i]
+        if quote:
+            if c == quote and text[i - 1] != "\\":
+                quote = None
+        elif c in "\"'":
+            quote = c
+        elif c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return len(text)
+
+def summarize_turn(msg):
+    role = "User" if msg.get("role") == "user" else "Assistant"
+    content = strip_chart_payloads(str(msg.get("content", "")))
+    sql = None
+    for lang, body in CODE_BLOCK_RE.findall(content):
+        if lang.lower() == "sql":
+            sql = " ".join(body.split())
+    prose = " ".join(CODE_BLOCK_RE.sub(" ", content).split())
+    line = truncate_to_tokens(SENTENCE_END_RE.split(prose, 1)[0], SUMMARY_TURN_TOKENS)
+    if sql:
+        line += f" (SQL: {truncate_to_tokens(sql, SUMMARY_TURN_TOKENS)})"
+    return f"- {role}: {line}"
+
+# Newest turns are kept verbatim (charts stripped) while they fit; everything older, or
+# anything that no longer fits, is folded into a one-line-per-turn rolling summary
+# (appended to any summary lines the session store already rolled up).
+def build_context(history, budget, summary=None):
+    if not history and not summary:
+        return ""
+
+    recent, used = [], 0
+    older = list(history or [])
+    while older and len(recent) < MAX_VERBATIM_TURNS:
+        msg = older[-1]
+        role = "User" if msg.get("role") == "user" else "Assistant"
+        line = f"{role}: {strip_chart_payloads(str(msg.get('content', '')))}\n"
+        cost = count_tokens(line)
+        if used + cost > budget * 0.75:
+            break
+        recent.insert(0, line)
+        used += cost
+        older.pop()
+
+    summary_lines = list(summary or []) + [summarize_turn(m) for m in older]
+    kept = []
+    for line in reversed(summary_lines):
+        cost = count_tokens(line) + 1
+        if used + cost > budget:
+            break
+        kept.insert(0, line)
+        used += cost
+
+    context_str = ""
+    if kept:
+        context_str += "\n\nCONVERSATION SUMMARY (older turns):\n" + "\n".join(kept)
+    if recent:
+        context_str += "\n\nPREVIOUS CONVERSATION:\n" + "".join(recent)
+    return context_str
+
+# build(context_str) must return the full prompt; history gets whatever the rest leaves over
+def assemble_prompt(build, history, budget=PROMPT_TOKEN_BUDGET, summary=None):
+    fixed = count_tokens(build(""))
+    context_str = build_context(history, max(0, budget - fixed), summary)
+    prompt = build(context_str)
+    return prompt, count_tokens(prompt)
@@ -0,0 +1,309 @@
+import os
+import re
+import json
+import time
+import threading
+from typing import Any
+import httpx
+from langchain_core.language_models import BaseChatModel
+from langchain_core.language_models.chat_models import generate_from_stream
+from langchain_groq import ChatGroq
+from langchain_openai import ChatOpenAI
+from circuit_breaker import CircuitBreaker
+from deadlines import remaining_s, check_deadline, deadline_exceeded
+from metrics import metrics
+
+LLM_TIMEOUT_S = int(os.getenv("LLM_TIMEOUT_S", "60"))
+# How long a backend is skipped after a connection error or 5xx without a Retry-After
+PROVIDER_ERROR_COOLDOWN_S = int(os.getenv("PROVIDER_ERROR_COOLDOWN_S", "10"))
+# Rounds of waiting for a backend to free up once every backend is limited
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+TIMEOUT_ERRORS = {"APITimeoutError", "ReadTimeout"}
+DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+# "1m30.5s", "250ms", "7.66s" (x-ratelimit-reset-*) or plain seconds (retry-after)
+def parse_duration(value):
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_RE.findall(value)
+    if not parts:
+        return None
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(n) * scale[unit] for n, unit in parts)
+
+# A call refused locally, before any request was sent: says nothing new about the provider
+class ShedError(Exception):
+    def __init__(self, message, retry_in):
+        super().__init__(message)
+        self.retry_in = retry_in
+
+# Every backend is limited and the earliest reset is past the request's deadline
+class RateLimitedError(ShedError):
+    status_code = 429
+
+    def __init__(self, retry_in):
+        super().__init__(f"All LLM backends are rate limited for another {retry_in:.1f}s", retry_in)
+
+# The backend that frees up first is cooling down after a 5xx or connection error, not a rate limit
+class ProviderUnavailableError(ShedError):
+    status_code = 503
+
+    def __init__(self, retry_in):
+        super().__init__(f"All LLM backends are cooling down after errors for another {retry_in:.1f}s", retry_in)
+
+def is_retryable(error):
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return bool(error_names(error) & ({"APIConnectionError", "ConnectError"} | TIMEOUT_ERRORS))
+
+# Class names along the MRO, so SDK errors match whichever wrapper (langchain_openai, groq) raised them
+def error_names(error):
+    return {cls.__name__ for cls in type(error).__mro__}
+
+# One API key on one endpoint. Quota is read from the x-ratelimit-* headers of every response
+# (Groq and OpenAI-compatible servers send the same ones) through an httpx response hook.
+class Backend:
+    def __init__(self, name, api_key, base_url=None, kind="groq", models=None):
+        self.name = name
+        self.api_key = api_key
+        self.base_url = base_url
+        self.kind = kind
+        # Our model name -> the name this provider uses for it
+        self.models = models or {}
+        self.http_client = httpx.Client(timeout=LLM_TIMEOUT_S, event_hooks={"response": [self.observe]})
+        self.inflight = 0
+        self.calls = 0
+        self.errors = 0
+        # "requests"/"tokens" -> (remaining, limit, monotonic time the window resets)
+        self.limits = {}
+        self.cooldown_until = 0
+        # "rate_limit" (429) or "error" (5xx, connection error): what cooldown_until is waiting out
+        self.cooldown_cause = None
+        self._chat_models = {}
+        self._lock = threading.Lock()
+
+    def observe(self, response):
+        headers, now = response.headers, time.monotonic()
+        with self._lock:
+            for kind in ("requests", "tokens"):
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                if remaining is None:
+                    continue
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}")) or 0
+                self.limits[kind] = (float(remaining), float(limit) if limit else None, now + reset)
+            if response.status_code == 429 or response.status_code >= 500:
+                wait = parse_duration(headers.get("retry-after"))
+                self.cooldown_until = now + (wait if wait is not None else PROVIDER_ERROR_COOLDOWN_S)
+                self.cooldown_cause = "rate_limit" if response.status_code == 429 else "error"
+
+    # Share of the tightest quota left (1.0 when unknown or the window has reset)
+    def headroom(self, now=None):
+        now = now or time.monotonic()
+        shares = [1.0]
+        for remaining, limit, reset_at in self.limits.values():
+            if reset_at > now:
+                shares.append(0.0 if remaining <= 0 else remaining / limit if limit else 1.0)
+        return min(shares)
+
+    def ready_at(self, now=None):
+        now = now or time.monotonic()
+        ready = self.cooldown_until
+        for remaining, _, reset_at in self.limits.values():
+            if remaining <= 0:
+                ready = max(ready, reset_at)
+        return ready if ready > now else now
+
+    # Not ready only because of an error cooldown (its quota, if known, is not what it waits for)
+    def failing(self, now=None):
+        now = now or time.monotonic()
+        if self.cooldown_cause != "error" or self.cooldown_until <= now:
+            return False
+        return all(reset_at <= self.cooldown_until for remaining, _, reset_at in self.limits.values() if remaining <= 0)
+
+    def available(self, now=None):
+        now = now or time.monotonic()
+        return self.ready_at(now) <= now and self.headroom(now) > 0
+
+    def load(self, now=None):
+        return self.inflight + (1 - self.headroom(now))
+
+    def failed(self, error):
+        with self._lock:
+            self.errors += 1
+            if getattr(error, "status_code", None) is None:
+                until = time.monotonic() + PROVIDER_ERROR_COOLDOWN_S
+                if until > self.cooldown_until:
+                    self.cooldown_until, self.cooldown_cause = until, "error"
+
+    def chat_model(self, model, streaming=False):
+        key = (model, streaming)
+        if key not in self._chat_models:
+            name = self.models.get(model, model)
+            if self.kind == "groq":
+                llm = ChatGroq(model=name, temperature=0, api_key=self.api_key, base_url=self.base_url,
+                               streaming=streaming, http_client=self.http_client, max_retries=0)
+            else:
+                llm = ChatOpenAI(model=name, temperature=0, api_key=self.api_key, base_url=self.base_url,
+                                 streaming=streaming, http_client=self.http_client, max_retries=0)
+            self._chat_models[key] = llm
+        return self._chat_models[key]
+
+    def snapshot(self):
+        now = time.monotonic()
+        return {
+            "inflight": self.inflight, "calls": self.calls, "errors": self.errors,
+            "headroom": round(self.headroom(now), 3), "available": self.available(now),
+            "ready_in_s": round(self.ready_at(now) - now, 2),
+        }
+
+# Keys from GROQ_API_KEY / GROQ_API_KEYS (comma-separated) plus LLM_PROVIDERS, a JSON list of
+# {"name", "api_key", "base_url", "kind": "groq"|"openai", "models": {our name: theirs}}.
+# Each call goes to the least-loaded available backend; rate-limited and failing ones are
+# skipped until their quota resets or their cooldown ends.
+class ProviderPool:
+    def __init__(self, backends):
+        self.backends = backends
+        self.breaker = CircuitBreaker()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        keys = [os.getenv("GROQ_API_KEY")] + os.getenv("GROQ_API_KEYS", "").split(",")
+        keys = list(dict.fromkeys(k.strip() for k in keys if k and k.strip()))
+        backends = [Backend(f"groq-{i + 1}", key) for i, key in enumerate(keys)]
+        for i, spec in enumerate(json.loads(os.getenv("LLM_PROVIDERS") or "[]")):
+            backends.append(Backend(spec.get("name") or f"provider-{i + 1}", spec["api_key"], spec.get("base_url"),
+                                    spec.get("kind") or ("openai" if spec.get("base_url") else "groq"), spec.get("models")))
+        return cls(backends)
+
+    # Reserves a backend (release() when done), or None when every backend not yet tried is
+    # limited or cooling down: a call its headers say will be refused is not sent at all
+    def acquire(self, exclude=()):
+        now = time.monotonic()
+        with self._lock:
+            available = [b for b in self.backends if b not in exclude and b.available(now)]
+            if not available:
+                return None
+            backend = min(available, key=lambda b: (b.load(now), b.calls))
+            backend.inflight += 1
+            backend.calls += 1
+        return backend
+
+    # Seconds until some backend can take a call again, going by its headers and cooldown
+    def ready_in(self):
+        now = time.monotonic()
+        with self._lock:
+            return min(b.ready_at(now) for b in self.backends) - now
+
+    # Why no call can be sent for `wait` seconds: rate limits, or backends cooling down after errors
+    def shed_error(self, wait):
+        now = time.monotonic()
+        with self._lock:
+            first = min(self.backends, key=lambda b: b.ready_at(now))
+        return ProviderUnavailableError(wait) if first.failing(now) else RateLimitedError(wait)
+
+    def release(self, backend):
+        with self._lock:
+            backend.inflight -= 1
+
+    def snapshot(self):
+        return {b.name: b.snapshot() for b in self.backends}
+
+# Chat model that sends each call to a backend picked by the pool, moving on to the next
+# backend when one is rate limited, overloaded or unreachable
+class PooledChatModel(BaseChatModel):
+    pool: Any
+    model_name: str
+    streaming: bool = False
+
+    @property
+    def _llm_type(self):
+        return "pooled"
+
+    @property
+    def _identifying_params(self):
+        return {"model_name": self.model_name}
+
+    # The breaker sees the outcome across all backends: it only opens when the whole pool is failing
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        breaker = self.pool.breaker
+        breaker.before_call()
+        try:
+            result = self._generate_on_pool(messages, stop, run_manager, **kwargs)
+        except ShedError:
+            # Nothing reached the provider, so this is no evidence it is down
+            breaker.record_ignored()
+            raise
+        except Exception as e:
+            if is_retryable(e):
+                breaker.record_failure()
+            else:
+                breaker.record_ignored()
+            raise
+        breaker.record_success()
+        return result
+
+    # When every backend is limited, waits exactly until the first one resets (per its
+    # retry-after / x-ratelimit-reset-* headers) before sending anything. If that is past the
+    # request's deadline the call is refused right away, without a request to any backend.
+    def _generate_on_pool(self, messages, stop, run_manager, **kwargs):
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            wait = self.pool.ready_in()
+            if wait > 0:
+                remaining = remaining_s()
+                if remaining is not None and wait > remaining:
+                    metrics.incr("llm_shed")
+                    print(f"Shedding LLM call: backends free up in {wait:.1f}s, {max(remaining, 0):.1f}s left")
+                    raise self.pool.shed_error(wait)
+                print(f"All LLM backends limited, retrying in {wait:.2f}s")
+                metrics.observe("llm_retry_wait_ms", wait * 1000)
+                time.sleep(wait)
+            try:
+                return self._try_backends(messages, stop, run_manager, **kwargs)
+            except Exception as e:
+                if not is_retryable(e) or attempt == LLM_MAX_RETRIES:
+                    raise
+
+    def _try_backends(self, messages, stop, run_manager, **kwargs):
+        tried, error = [], None
+        while True:
+            check_deadline("llm")
+            backend = self.pool.acquire(tried)
+            if backend is None:
+                raise error or self.pool.shed_error(max(self.pool.ready_in(), 0))
+            tried.append(backend)
+            # No call may outlive the request
+            remaining = remaining_s()
+            bounded = remaining is not None and remaining < LLM_TIMEOUT_S
+            if bounded:
+                kwargs["timeout"] = remaining
+            try:
+                llm = backend.chat_model(self.model_name, self.streaming)
+                if self.streaming:
+                    return generate_from_stream(llm._stream(messages, stop=stop, run_manager=run_manager, **kwargs))
+                return llm._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            except Exception as e:
+                # Cut short by the deadline, not the backend's fault
+                if bounded and error_names(e) & TIMEOUT_ERRORS:
+                    raise deadline_exceeded("llm") from e
+                backend.failed(e)
+                if not is_retryable(e):
+                    raise
+                print(f"LLM backend {backend.name} failed ({type(e).__name__}), trying another")
+                error = e
+            finally:
+                self.pool.release(backend)
+
+    def _combine_llm_outputs(self, llm_outputs):
+        usage = {}
+        for output in llm_outputs:
+            for k, v in ((output or {}).get("token_usage") or {}).items():
+                if isinstance(v, (int, float)):
+                    usage[k] = usage.get(k, 0) + v
+        return {"token_usage": usage, "model_name": self.model_name}
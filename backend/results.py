@@ -0,0 +1,72 @@
+import os
+import uuid
+import threading
+from collections import OrderedDict
+import pandas as pd
+
+RESULT_INLINE_ROWS = int(os.getenv("RESULT_INLINE_ROWS", "50"))
+RESULT_SAMPLE_ROWS = 5
+RESULT_TOP_K = 5
+RESULT_MAX_VALUE_CHARS = 80
+RESULT_STORE_MAX_ENTRIES = int(os.getenv("RESULT_STORE_MAX_ENTRIES", "50"))
+RESULT_STORE_MAX_ROWS = int(os.getenv("RESULT_STORE_MAX_ROWS", "2000000"))
+
+# Full query results kept server-side (LRU, bounded by entry count and total rows) so the LLM
+# only ever sees a summary, while charting and export still work from every row.
+class ResultStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+        self._rows = 0
+
+    def put(self, sql, columns, rows):
+        handle = "r_" + uuid.uuid4().hex[:12]
+        with self._lock:
+            self._results[handle] = (sql, columns, rows)
+            self._rows += len(rows)
+            while len(self._results) > 1 and (len(self._results) > RESULT_STORE_MAX_ENTRIES or self._rows > RESULT_STORE_MAX_ROWS):
+                _, (_, _, old_rows) = self._results.popitem(last=False)
+                self._rows -= len(old_rows)
+        return handle
+
+    def get(self, handle):
+        with self._lock:
+            entry = self._results.get(handle)
+            if entry is not None:
+                self._results.move_to_end(handle)
+            return entry
+
+result_store = ResultStore()
+
+def _fmt(value):
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    text = str(value)
+    return text if len(text) <= RESULT_MAX_VALUE_CHARS else text[:RESULT_MAX_VALUE_CHARS] + "..."
+
+# Vectorised per-column profile of a large result: counts and quantiles for numeric
+# columns, distinct count and top-k values for the rest, plus a few sample rows.
+def summarize_result(handle, columns, rows):
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    lines = [
+        f"Result {handle}: {len(df):,} rows x {len(columns)} columns (too large to show; full result kept server-side for charts and export).",
+        "Column summary:",
+    ]
+    for i, name in enumerate(columns):
+        col = df.iloc[:, i]
+        nulls = int(col.isna().sum())
+        numeric = pd.to_numeric(col, errors="coerce") if col.dtype == object else col
+        if pd.api.types.is_numeric_dtype(numeric) and numeric.notna().sum() == col.notna().sum() and col.notna().any():
+            q = numeric.quantile([0, 0.25, 0.5, 0.75, 1]).tolist()
+            lines.append(
+                f"- {name} (numeric): nulls={nulls}, mean={_fmt(numeric.mean())}, "
+                f"min={_fmt(q[0])}, p25={_fmt(q[1])}, median={_fmt(q[2])}, p75={_fmt(q[3])}, max={_fmt(q[4])}"
+            )
+        else:
+            counts = col.value_counts(dropna=True)
+            top = ", ".join(f"{_fmt(v)!r}: {c}" for v, c in counts.head(RESULT_TOP_K).items())
+            lines.append(f"- {name} (text): nulls={nulls}, distinct={len(counts)}, top=[{top}]")
+    sample = [tuple(v if isinstance(v, (int, float)) or v is None else _fmt(v) for v in r) for r in rows[:RESULT_SAMPLE_ROWS]]
+    lines.append(f"Sample rows: {sample}")
+    lines.append("For exact figures run an aggregate query (GROUP BY, COUNT, AVG, ORDER BY ... LIMIT) instead of listing rows.")
+    return "\n".join(lines)
@@ -0,0 +1,129 @@
+import re
+import sqlite3
+import hashlib
+import threading
+
+# Per-database table schemas, re-read only when SQLite's schema_version changes; tables
+# whose definition did not change keep their entry
+_schemas = {}
+# Bumped by table_rewritten(): a table replaced in place can get back the same definition and root page
+_generations = {}
+# Schema-only artifacts shared by every table with the same fingerprint
+_summaries = {}
+_lock = threading.Lock()
+
+TABLE_PLACEHOLDER = "{table}"
+
+def quote_ident(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+# Re-uploads of the same file only differ in case/padding of names and in
+# INTEGER vs REAL inference, so types are reduced to their storage class
+def normalize_column(name):
+    return " ".join(str(name).split()).lower()
+
+def normalize_type(declared):
+    declared = (declared or "").upper()
+    if any(t in declared for t in ("CHAR", "CLOB", "TEXT")):
+        return "TEXT"
+    if "BLOB" in declared or not declared:
+        return "BLOB"
+    return "NUMERIC"
+
+def _fingerprint(columns):
+    spec = ";".join(f"{name}:{kind}" for name, kind in columns)
+    return hashlib.sha256(spec.encode()).hexdigest()[:16]
+
+def table_schemas(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        version = conn.execute("PRAGMA schema_version").fetchone()[0]
+        cached = _schemas.get(db_path)
+        if cached and cached[0] == version:
+            return cached[1]
+        previous = cached[1] if cached else {}
+        schemas = {}
+        for table, sql, rootpage in conn.execute("SELECT name, sql, rootpage FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'").fetchall():
+            old = previous.get(table)
+            if old and old["definition"] == (sql, rootpage):
+                schemas[table] = old
+                continue
+            columns = [(normalize_column(c[1]), normalize_type(c[2])) for c in conn.execute(f"PRAGMA table_info({quote_ident(table)})")]
+            schemas[table] = {"fingerprint": _fingerprint(columns), "columns": columns, "definition": (sql, rootpage)}
+    finally:
+        conn.close()
+    with _lock:
+        _schemas[db_path] = (version, schemas)
+    return schemas
+
+# Changes when this table is created, altered or rewritten, but not when other tables come and
+# go (per-turn result tables are created with every answer), so caches keyed on it survive those
+def table_version(db_path, table):
+    schema = table_schemas(db_path).get(table)
+    if schema is None:
+        return None
+    return schema["definition"] + (_generations.get((db_path, None), 0), _generations.get((db_path, table), 0))
+
+# After a table's rows were replaced outside the caches' view (upload, writes through the SQL tool).
+# table=None: any table may have changed.
+def table_rewritten(db_path, table=None):
+    with _lock:
+        _generations[(db_path, table)] = _generations.get((db_path, table), 0) + 1
+
+def schema_fingerprint(db_path, table):
+    schema = table_schemas(db_path).get(table)
+    return schema["fingerprint"] if schema else None
+
+def tables_with_schema(db_path, fingerprint):
+    return sorted(t for t, s in table_schemas(db_path).items() if s["fingerprint"] == fingerprint)
+
+STRING_LITERAL_RE = re.compile(r"('(?:[^']|'')*')")
+
+# SQL with the table name swapped for a placeholder (string literals untouched),
+# so it can run against any table sharing the schema
+def templatize(sql, table):
+    name = re.escape(table)
+    pattern = re.compile(r'(?<![\w."])(?:"' + name + r'"|`' + name + r'`|\[' + name + r'\]|' + name + r')(?![\w"])', re.IGNORECASE)
+    parts = STRING_LITERAL_RE.split(sql)
+    return "".join(part if i % 2 else pattern.sub(TABLE_PLACEHOLDER, part) for i, part in enumerate(parts))
+
+def instantiate(template, table):
+    return template.replace(TABLE_PLACEHOLDER, quote_ident(table))
+
+def schema_summary(db_path, table):
+    schema = table_schemas(db_path)[table]
+    summary = _summaries.get(schema["fingerprint"])
+    if summary is None:
+        cols = ",\n".join(f"\t{quote_ident(name)} {kind}" for name, kind in schema["columns"])
+        summary = f"CREATE TABLE {TABLE_PLACEHOLDER} (\n{cols}\n)"
+        with _lock:
+            _summaries[schema["fingerprint"]] = summary
+    return summary.replace(TABLE_PLACEHOLDER, quote_ident(table))
+
+# Sample rows depend on the data, so they are always read fresh
+def sample_rows(db_path, table, limit=3, columns=None):
+    select = ", ".join(quote_ident(c) for c in columns) if columns else "*"
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.execute(f"SELECT {select} FROM {quote_ident(table)} LIMIT ?", (limit,))
+        names = [d[0] for d in cursor.description]
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+    lines = "\n".join("\t".join(str(v)[:100] for v in row) for row in rows)
+    return f"{limit} rows from {table} table:\n" + "\t".join(names) + f"\n{lines}"
+
+# Only some columns of a wide table (see column_index.py); the rest are just counted
+def partial_summary(db_path, table, columns):
+    schema = table_schemas(db_path)[table]
+    wanted = {c.lower() for c in columns}
+    shown = [(name, kind) for name, kind in schema["columns"] if name in wanted]
+    cols = ",\n".join(f"\t{quote_ident(name)} {kind}" for name, kind in shown)
+    hidden = len(schema["columns"]) - len(shown)
+    return f"CREATE TABLE {quote_ident(table)} (\n{cols}\n\t-- {hidden} less relevant columns not shown\n)"
+
+def table_info(db_path, table, limit=3, columns=None):
+    info = partial_summary(db_path, table, columns) if columns else schema_summary(db_path, table)
+    if limit:
+        info += f"\n\n/*\n{sample_rows(db_path, table, limit, columns)}\n*/"
+    return info
@@ -0,0 +1,93 @@
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict, deque
+from prompting import strip_chart_payloads, summarize_turn
+
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "12"))
+SESSION_MAX_SUMMARY_LINES = int(os.getenv("SESSION_MAX_SUMMARY_LINES", "20"))
+SESSION_IDLE_SECONDS = int(os.getenv("SESSION_IDLE_SECONDS", "1800"))
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "1000"))
+SESSION_MAX_TURN_TABLES = int(os.getenv("SESSION_MAX_TURN_TABLES", "3"))
+TURN_TABLE_PREFIX = "tmp_turn_"
+
+class Session:
+    def __init__(self, session_id):
+        self.id = session_id
+        self.turns = deque()
+        self.summary = deque(maxlen=SESSION_MAX_SUMMARY_LINES)
+        self.last_seen = time.monotonic()
+        # Materialised results of earlier turns: dicts with table, sql, columns, rows
+        self.turn_tables = deque()
+        self.table_prefix = f"{TURN_TABLE_PREFIX}{uuid.uuid4().hex[:8]}_"
+        self.turn_count = 0
+
+# Conversation state kept server-side so clients only send a session id and the new question.
+# Turns are stored compacted (chart payloads stripped); turns past SESSION_MAX_TURNS roll into
+# the summary, and sessions idle for SESSION_IDLE_SECONDS are dropped. `on_drop_tables` is
+# called (outside the lock) with turn tables that fall out of a session or leave with it.
+class SessionStore:
+    def __init__(self, on_drop_tables=None):
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self.on_drop_tables = on_drop_tables
+
+    def _evict(self, now):
+        evicted = []
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.last_seen < SESSION_IDLE_SECONDS and len(self._sessions) <= MAX_SESSIONS:
+                break
+            self._sessions.popitem(last=False)
+            evicted.extend(t["table"] for t in oldest.turn_tables)
+        return evicted
+
+    def _drop(self, tables):
+        if tables and self.on_drop_tables:
+            self.on_drop_tables(tables)
+
+    def get_or_create(self, session_id=None):
+        now = time.monotonic()
+        with self._lock:
+            evicted = self._evict(now)
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                session = Session(session_id or uuid.uuid4().hex)
+                self._sessions[session.id] = session
+            session.last_seen = now
+            self._sessions.move_to_end(session.id)
+        self._drop(evicted)
+        return session
+
+    def next_turn_table(self, session):
+        with self._lock:
+            session.turn_count += 1
+            return f"{session.table_prefix}{session.turn_count}"
+
+    def add_turn_table(self, session, entry):
+        with self._lock:
+            session.turn_tables.append(entry)
+            dropped = []
+            while len(session.turn_tables) > SESSION_MAX_TURN_TABLES:
+                dropped.append(session.turn_tables.popleft()["table"])
+        self._drop(dropped)
+
+    def turn_tables(self, session):
+        with self._lock:
+            return list(session.turn_tables)
+
+    def snapshot(self, session):
+        with self._lock:
+            return list(session.turns), list(session.summary)
+
+    def append(self, session, role, content):
+        with self._lock:
+            session.turns.append({"role": role, "content": strip_chart_payloads(str(content or ""))})
+            while len(session.turns) > SESSION_MAX_TURNS:
+                session.summary.append(summarize_turn(session.turns.popleft()))
+            session.last_seen = time.monotonic()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
@@ -0,0 +1,41 @@
+import threading
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+# Collapses concurrent calls that share a key onto one execution.
+# Followers block on the leader's result; if the leader raises, the first
+# follower to grab the lock is promoted to leader and runs fn again.
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    # timeout bounds how long a follower waits for the leader (TimeoutError)
+    def do(self, key, fn, timeout=None):
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+
+            if leader:
+                try:
+                    call.result = fn()
+                    return call.result, False
+                except BaseException as e:
+                    call.error = e
+                    raise
+                finally:
+                    with self._lock:
+                        self._calls.pop(key, None)
+                    call.done.set()
+
+            if not call.done.wait(timeout):
+                raise TimeoutError("Timed out waiting for an identical request in flight")
+            if call.error is None:
+                return call.result, True
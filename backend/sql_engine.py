@@ -0,0 +1,170 @@
+import re
+import sqlite3
+from langchain_community.utilities import SQLDatabase
+from langchain_community.utilities.sql_database import truncate_word
+from results import RESULT_INLINE_ROWS, result_store, summarize_result
+from schemas import table_info, table_rewritten, quote_ident
+from column_index import column_index
+from sql_repair import repair_sql, hit_auto_limit, SQLRepairError
+from sql_optimizer import optimize_sql
+from stats import stats
+from sql_guard import run_guarded
+
+NO_SUCH_COLUMN_RE = re.compile(r"no such column: (\S+)")
+
+def is_read_only(sql):
+    first = sql.lstrip("( \n\t").split(None, 1)[0].lower() if sql.strip() else ""
+    return first in ("select", "with")
+
+# Read-only, under the guardrails of sql_guard (time, VM steps, rows, memory, deadline).
+# Returns (columns, rows, truncated): truncated when the row cap or the added LIMIT cut the result.
+def run_select(db_path, sql):
+    columns, rows, truncated = run_guarded(db_path, sql)
+    return columns, rows, truncated or hit_auto_limit(sql, rows)
+
+# Repair, then optimise reads. Returns (sql, notes); raises SQLRepairError if the LLM has to fix it
+def prepare_sql(db_path, sql, tables, active_table=None):
+    sql, fixes = repair_sql(db_path, sql, tables, active_table)
+    if fixes:
+        print(f"Repaired SQL ({'; '.join(fixes)}): {sql}")
+    if not is_read_only(sql):
+        return sql, fixes
+    sql, rewrites = optimize_sql(db_path, sql)
+    return sql, fixes + rewrites
+
+def list_tables(db_path, prefix=""):
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE ? ESCAPE '\\'",
+                            (prefix.replace("_", "\\_") + "%",)).fetchall()
+    finally:
+        conn.close()
+    return [r[0] for r in rows]
+
+# Writes an already-fetched result into its own table (no re-execution of the defining SQL)
+def materialize_rows(db_path, table, columns, rows):
+    cols = ", ".join(quote_ident(c) for c in columns)
+    marks = ", ".join("?" for _ in columns)
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute(f"DROP TABLE IF EXISTS {quote_ident(table)}")
+        conn.execute(f"CREATE TABLE {quote_ident(table)} ({cols})")
+        conn.executemany(f"INSERT INTO {quote_ident(table)} VALUES ({marks})", rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+# Plain indexes on categorical columns, so resolved-value equality filters don't scan
+def create_value_indexes(db_path, table, columns):
+    conn = sqlite3.connect(db_path)
+    try:
+        for column in columns:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {quote_ident(f'idx_{table}_{column}')} ON {quote_ident(table)} ({quote_ident(column)})")
+        conn.commit()
+    finally:
+        conn.close()
+
+def drop_tables(db_path, tables):
+    conn = sqlite3.connect(db_path)
+    try:
+        for table in tables:
+            conn.execute(f"DROP TABLE IF EXISTS {quote_ident(table)}")
+        conn.commit()
+    finally:
+        conn.close()
+
+# SQLDatabase whose query tool runs statements through sqlite3 directly, under the
+# guardrails of sql_guard, and keeps the columns and rows of the last successful SELECT,
+# so charts can be built from the real result set instead of the text the agent writes
+# back. Results over RESULT_INLINE_ROWS reach the LLM only as a statistical summary with
+# a result handle. Table info comes from the schema cache (shared per fingerprint) plus
+# fresh sample rows, so no SQLAlchemy reflection is needed. Every statement is validated
+# and, where possible, repaired locally first; only unrepairable errors go back to the agent.
+# For very wide tables only the columns relevant to the question are described.
+# With allow_writes off (cheaper cascade tiers) statements that change data are refused
+# and flagged in write_blocked, so the question goes to the final tier instead.
+class DataPulseSQLDatabase(SQLDatabase):
+    last_result = None
+    last_handle = None
+    # The statement as the agent wrote it, before repairs, for last_result
+    last_query = None
+    active_table = None
+    column_focus = None
+    focus_question = ""
+    wrote = False
+    allow_writes = True
+    write_blocked = False
+
+    @property
+    def db_path(self):
+        return self._engine.url.database
+
+    def get_table_info(self, table_names=None, get_col_comments=False):
+        usable = self.get_usable_table_names()
+        if table_names is not None:
+            missing = set(table_names).difference(usable)
+            if missing:
+                raise ValueError(f"table_names {missing} not found in database")
+            usable = table_names
+        focus = self.column_focus or {}
+        return "\n\n".join(table_info(self.db_path, t, self._sample_rows_in_table_info, focus.get(t)) for t in usable)
+
+    def focus_columns(self, table, question, extra=()):
+        index = column_index(self.db_path, table)
+        if index:
+            self.column_focus = {table: index.select(question, extra=extra)}
+            self.focus_question = question
+
+    # Returns the columns newly added to the prompt (empty when nothing could be widened)
+    def widen_focus(self, missing):
+        added = []
+        for table, current in (self.column_focus or {}).items():
+            widened = column_index(self.db_path, table).widen(current, self.focus_question, missing)
+            added += [c for c in widened if c not in current]
+            self.column_focus[table] = widened
+        if added:
+            print(f"Widened column focus after missing column '{missing}': +{len(added)} columns")
+        return added
+
+    def run_no_throw(self, command, fetch="all", include_columns=False, **kwargs):
+        sql = query = str(command).strip().rstrip(";").strip()
+        if fetch != "all" or include_columns or kwargs.get("parameters"):
+            return super().run_no_throw(command, fetch, include_columns, **kwargs)
+
+        try:
+            sql, fixes = prepare_sql(self.db_path, sql, self.get_usable_table_names(), self.active_table)
+        except SQLRepairError as e:
+            missing = NO_SUCH_COLUMN_RE.search(str(e))
+            added = self.widen_focus(missing.group(1)) if missing else []
+            if added:
+                return f"Error: {e}. The table has more columns than were shown; these may be relevant: {', '.join(added[:30])}"
+            return f"Error: {e}"
+        note = f"Note: the query was corrected before running ({'; '.join(fixes)}): {' '.join(sql.split())}\n" if fixes else ""
+        if not is_read_only(sql):
+            if not self.allow_writes:
+                self.write_blocked = True
+                return "Error: statements that change data are not run at this step. Do not retry; give your Final Answer now."
+            try:
+                _, rows, _ = run_guarded(self.db_path, sql, read_only=False)
+            except sqlite3.Error as e:
+                return f"Error: {e}"
+            self.wrote = True
+            stats.invalidate(self.db_path)
+            table_rewritten(self.db_path)
+            return note + (str(rows) if rows else "")
+
+        try:
+            columns, rows, truncated = run_select(self.db_path, sql)
+        except sqlite3.Error as e:
+            return f"Error: {e}"
+
+        self.last_result = (sql, columns, rows, truncated)
+        self.last_query = query
+        self.last_handle = result_store.put(sql, columns, rows)
+        if truncated:
+            note += f"Note: the result was cut off after {len(rows)} rows; aggregate or filter to cover all rows.\n"
+        if not rows:
+            return note
+        if len(rows) > RESULT_INLINE_ROWS:
+            return note + summarize_result(self.last_handle, columns, rows)
+        return note + str([tuple(truncate_word(v, length=self._max_string_length) for v in row) for row in rows])
@@ -0,0 +1,140 @@
+import os
+import time
+import uuid
+import logging
+import sqlite3
+import threading
+from metrics import metrics
+from deadlines import deadline_passed
+
+logger = logging.getLogger(__name__)
+
+# Per-statement budgets for LLM-written SQL
+SQL_TIMEOUT_MS = int(os.getenv("SQL_TIMEOUT_MS", "20000"))
+SQL_MAX_VM_STEPS = int(os.getenv("SQL_MAX_VM_STEPS", "2000000000"))
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", "100000"))
+SQL_MAX_RESULT_MB = int(os.getenv("SQL_MAX_RESULT_MB", "64"))
+# Page cache per connection (SQLite's default is 2 MB)
+SQL_CACHE_MB = int(os.getenv("SQL_CACHE_MB", "64"))
+# Process-wide cap on SQLite's heap (0 = off); also covers uploads and index builds
+SQLITE_HARD_HEAP_LIMIT_MB = int(os.getenv("SQLITE_HARD_HEAP_LIMIT_MB", "0"))
+# The progress handler runs every this many VM instructions
+PROGRESS_INTERVAL = 1000
+FETCH_BATCH = 1000
+
+def kill_message(reason):
+    return {
+        "time": f"took longer than {SQL_TIMEOUT_MS} ms",
+        "steps": f"ran more than {SQL_MAX_VM_STEPS} VM steps",
+        "memory": f"returned more than {SQL_MAX_RESULT_MB} MB of rows",
+        "deadline": "ran past the request's deadline",
+        "cancelled": "was cancelled",
+    }[reason]
+
+# Subclass of sqlite3.OperationalError so existing `except sqlite3.Error` handling still applies
+class SQLGuardError(sqlite3.OperationalError):
+    def __init__(self, reason):
+        hint = " Add join conditions or filters, or aggregate instead of selecting raw rows." if reason in ("time", "steps", "memory") else ""
+        super().__init__(f"query stopped: it {kill_message(reason)}.{hint}")
+        self.reason = reason
+
+if SQLITE_HARD_HEAP_LIMIT_MB:
+    sqlite3.connect(":memory:").execute(f"PRAGMA hard_heap_limit = {SQLITE_HARD_HEAP_LIMIT_MB * 1024 * 1024}")
+
+# Budget and cancellation state of one running statement; SQLite calls it as the progress
+# handler and aborts the statement ("interrupted") as soon as it returns non-zero
+class QueryGuard:
+    def __init__(self, conn, sql):
+        self.id = uuid.uuid4().hex[:12]
+        self.conn = conn
+        self.sql = sql
+        self.started = time.monotonic()
+        self.steps = 0
+        self.reason = None
+
+    def elapsed_ms(self):
+        return (time.monotonic() - self.started) * 1000
+
+    def __call__(self):
+        self.steps += PROGRESS_INTERVAL
+        if self.reason is None:
+            if self.steps > SQL_MAX_VM_STEPS:
+                self.reason = "steps"
+            elif self.elapsed_ms() > SQL_TIMEOUT_MS:
+                self.reason = "time"
+            elif deadline_passed():
+                self.reason = "deadline"
+        return self.reason is not None
+
+    # Safe from any thread: interrupt() makes the running statement fail at the next VM step
+    def cancel(self):
+        self.reason = self.reason or "cancelled"
+        self.conn.interrupt()
+
+    def killed(self):
+        metrics.incr(f"sql_killed.{self.reason}")
+        logger.warning("Killed SQL %s (%s) after %.0f ms, %d VM steps: %s", self.id, self.reason, self.elapsed_ms(), self.steps, " ".join(self.sql.split()))
+        return SQLGuardError(self.reason)
+
+    def snapshot(self):
+        return {"id": self.id, "sql": self.sql, "elapsed_ms": round(self.elapsed_ms(), 1), "vm_steps": self.steps}
+
+running = {}
+_lock = threading.Lock()
+
+def _row_bytes(row):
+    return 56 + sum(len(v) if isinstance(v, (str, bytes)) else 8 for v in row)
+
+# Runs one statement under the budgets above. Returns (columns, rows, truncated); at most
+# SQL_MAX_ROWS rows are fetched, truncated tells whether more were left.
+# Writes are committed only when the statement finished within budget.
+def run_guarded(db_path, sql, read_only=True):
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    guard = QueryGuard(conn, sql)
+    with _lock:
+        running[guard.id] = guard
+    try:
+        if read_only:
+            conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA cache_size = {-SQL_CACHE_MB * 1024}")
+        conn.set_progress_handler(guard, PROGRESS_INTERVAL)
+        cursor = conn.execute(sql)
+        columns = [d[0] for d in cursor.description or []]
+        rows, size, truncated = [], 0, False
+        while columns:
+            batch = cursor.fetchmany(FETCH_BATCH)
+            if not batch:
+                break
+            rows += batch
+            size += sum(_row_bytes(row) for row in batch)
+            if size > SQL_MAX_RESULT_MB * 1024 * 1024:
+                guard.reason = "memory"
+                raise guard.killed()
+            if len(rows) > SQL_MAX_ROWS or len(rows) == SQL_MAX_ROWS and cursor.fetchone() is not None:
+                rows, truncated = rows[:SQL_MAX_ROWS], True
+                metrics.incr("sql_rows_capped")
+                logger.warning("Result of SQL %s capped at %d rows", guard.id, SQL_MAX_ROWS)
+                break
+        if not read_only:
+            conn.commit()
+        return columns, rows, truncated
+    except sqlite3.OperationalError as e:
+        if guard.reason and not isinstance(e, SQLGuardError):
+            raise guard.killed() from e
+        raise
+    finally:
+        with _lock:
+            running.pop(guard.id, None)
+        conn.close()
+
+def running_queries():
+    with _lock:
+        return [g.snapshot() for g in running.values()]
+
+def cancel_query(query_id):
+    with _lock:
+        guard = running.get(query_id)
+    if guard is None:
+        return False
+    guard.cancel()
+    return True
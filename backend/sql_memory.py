@@ -0,0 +1,133 @@
+import os
+import re
+import math
+import time
+import sqlite3
+import threading
+from collections import Counter
+from schemas import templatize, instantiate, TABLE_PLACEHOLDER
+
+SQL_MEMORY_PATH = os.getenv("SQL_MEMORY_PATH", "sql_memory.db")
+FEW_SHOT_THRESHOLD = float(os.getenv("SQL_MEMORY_FEW_SHOT", "0.45"))
+FEW_SHOT_EXAMPLES = 3
+CANDIDATE_LIMIT = 500
+
+WORD_RE = re.compile(r"[a-z_]+|\d+(?:\.\d+)?|'[^']*'|\"[^\"]*\"")
+STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "for", "to", "and", "or", "is", "are", "was", "were", "be",
+    "what", "which", "who", "how", "me", "my", "show", "give", "tell", "list", "please", "can", "you",
+    "i", "we", "with", "by", "from", "that", "this", "it", "do", "does", "all", "there", "their",
+}
+# Questions leaning on earlier turns depend on context the stored SQL does not have
+FOLLOW_UP_WORDS = {"that", "those", "these", "it", "them", "previous", "above", "same", "again"}
+
+def _stem(word):
+    return word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+
+def tokenize(question):
+    return [_stem(w) for w in WORD_RE.findall(question.lower()) if w not in STOPWORDS]
+
+def normalize(question):
+    return " ".join(tokenize(question))
+
+def is_follow_up(question):
+    return any(w in FOLLOW_UP_WORDS for w in re.findall(r"[a-z]+", question.lower()))
+
+# Persistent (schema fingerprint, question, validated SQL, latency) pairs. New questions are
+# matched lexically (IDF-weighted cosine over question tokens) against pairs learned on any
+# table with the same schema: SQL is stored with a {table} placeholder and instantiated for
+# the active table. The score only picks few-shot examples: direct reuse (no LLM call) needs
+# the same normalized question, since words like highest/lowest or above/below barely move it.
+class SQLMemory:
+    def __init__(self, path=SQL_MEMORY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sql_memory ("
+            " fingerprint TEXT, table_name TEXT, question TEXT, normalized TEXT, sql TEXT,"
+            " latency_ms REAL, uses INTEGER DEFAULT 0, updated_at REAL,"
+            " PRIMARY KEY (fingerprint, table_name, normalized))"
+        )
+        conn.commit()
+        conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def record(self, fingerprint, table, question, sql, latency_ms):
+        normalized = normalize(question)
+        if not normalized:
+            return
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT INTO sql_memory (fingerprint, table_name, question, normalized, sql, latency_ms, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT (fingerprint, table_name, normalized) DO UPDATE SET"
+                    " question = excluded.question, sql = excluded.sql, latency_ms = excluded.latency_ms, updated_at = excluded.updated_at",
+                    (fingerprint, table, question, normalized, templatize(sql, table), latency_ms, time.time()),
+                )
+                conn.commit()
+            finally:
+                conn.close()
+
+    def mark_used(self, fingerprint, table, normalized):
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("UPDATE sql_memory SET uses = uses + 1 WHERE fingerprint = ? AND table_name = ? AND normalized = ?",
+                             (fingerprint, table, normalized))
+                conn.commit()
+            finally:
+                conn.close()
+
+    # Returns [(score, reusable, row dict)] best first
+    def search(self, fingerprint, table, question, limit=FEW_SHOT_EXAMPLES):
+        query = tokenize(question)
+        if not query:
+            return []
+        conn = self._connect()
+        try:
+            # Pairs from other tables are only usable once templated
+            rows = conn.execute(
+                "SELECT question, normalized, sql, latency_ms, table_name FROM sql_memory"
+                " WHERE fingerprint = ? AND (table_name = ? OR instr(sql, ?) > 0)"
+                " ORDER BY table_name = ? DESC, uses DESC, updated_at DESC LIMIT ?",
+                (fingerprint, table, TABLE_PLACEHOLDER, table, CANDIDATE_LIMIT)
+            ).fetchall()
+        finally:
+            conn.close()
+        if not rows:
+            return []
+
+        # The same question learned on several tables counts once
+        seen = set()
+        rows = [r for r in rows if not (r[1] in seen or seen.add(r[1]))]
+        docs = [r[1].split() for r in rows]
+        df = Counter(t for doc in docs for t in set(doc))
+        idf = lambda t: math.log((len(docs) + 1) / (df.get(t, 0) + 1)) + 1
+
+        def vector(tokens):
+            return {t: c * idf(t) for t, c in Counter(tokens).items()}
+
+        qv = vector(query)
+        qn = math.sqrt(sum(v * v for v in qv.values()))
+        scored = []
+        for (q_text, normalized, sql, latency, source), doc in zip(rows, docs):
+            dv = vector(doc)
+            dn = math.sqrt(sum(v * v for v in dv.values()))
+            score = sum(w * dv.get(t, 0) for t, w in qv.items()) / (qn * dn) if qn and dn else 0.0
+            if score >= FEW_SHOT_THRESHOLD:
+                reusable = query == doc and not is_follow_up(question)
+                scored.append((score, reusable, {"question": q_text, "normalized": normalized, "sql": instantiate(sql, table),
+                                                 "source_table": source, "latency_ms": latency}))
+        scored.sort(key=lambda s: -s[0])
+        return scored[:limit]
+
+def describe_examples(matches):
+    if not matches:
+        return ""
+    lines = "\n".join(f"Q: {m['question']}\nSQL: {' '.join(m['sql'].split())}" for _, _, m in matches)
+    return f"\n\nSIMILAR PAST QUESTIONS (validated SQL for this dataset, adapt as needed):\n{lines}"
@@ -0,0 +1,362 @@
+import re
+import sqlite3
+from schemas import table_schemas, quote_ident
+from stats import stats
+from fts import ensure_index, can_use_index
+
+LIKE_MAX_VALUES = 20
+
+TOKEN_RE = re.compile(
+    r"(?P<ws>\s+)|(?P<comment>--[^\n]*|/\*.*?\*/)|(?P<str>'(?:[^']|'')*')"
+    r"|(?P<ident>\"(?:[^\"]|\"\")*\"|`[^`]*`|\[[^\]]*\])|(?P<num>\d+(?:\.\d*)?)|(?P<word>\w+)"
+    r"|(?P<op><=|>=|<>|!=|==|\|\||.)",
+    re.S,
+)
+CLAUSE_END = {"GROUP", "ORDER", "LIMIT", "HAVING", "WINDOW", "UNION", "EXCEPT", "INTERSECT"}
+PREDICATE_WORDS = {"AND", "OR", "NOT", "NULL", "IS", "IN", "LIKE", "GLOB", "BETWEEN", "TRUE", "FALSE", "CASE", "WHEN",
+                   "THEN", "ELSE", "END", "ESCAPE", "COLLATE", "NOCASE", "BINARY", "RTRIM"}
+
+def tokenize(sql):
+    return [(m.lastgroup, m.group(0)) for m in TOKEN_RE.finditer(sql)]
+
+def render(tokens):
+    return "".join(t for _, t in tokens)
+
+def unquote(token):
+    kind, text = token
+    return text[1:-1].replace('""', '"') if kind == "ident" else text
+
+def is_word(token, *words):
+    return token[0] == "word" and token[1].upper() in words
+
+def significant(tokens, start=0, step=1):
+    i = start
+    while 0 <= i < len(tokens) and tokens[i][0] in ("ws", "comment"):
+        i += step
+    return i
+
+def depths(tokens):
+    depth, out = 0, []
+    for kind, text in tokens:
+        if text == ")":
+            depth -= 1
+        out.append(depth)
+        if text == "(":
+            depth += 1
+    return out
+
+def matching_paren(tokens, start):
+    depth = 0
+    for i in range(start, len(tokens)):
+        if tokens[i][1] == "(":
+            depth += 1
+        elif tokens[i][1] == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+    return None
+
+def query_plan(db_path, sql):
+    conn = sqlite3.connect(db_path)
+    try:
+        return "; ".join(r[3] for r in conn.execute(f"EXPLAIN QUERY PLAN {sql}"))
+    except sqlite3.Error as e:
+        return f"error: {e}"
+    finally:
+        conn.close()
+
+# alias/name -> table for every FROM/JOIN source that is a real table
+def source_tables(tokens, db_path):
+    schemas = table_schemas(db_path)
+    names = {t.lower(): t for t in schemas}
+    sources = {}
+    for i, token in enumerate(tokens):
+        if not is_word(token, "FROM", "JOIN"):
+            continue
+        j = significant(tokens, i + 1)
+        if j >= len(tokens) or tokens[j][0] not in ("word", "ident"):
+            continue
+        table = names.get(unquote(tokens[j]).lower())
+        if not table:
+            continue
+        sources[table.lower()] = table
+        k = significant(tokens, j + 1)
+        if k < len(tokens) and is_word(tokens[k], "AS"):
+            k = significant(tokens, k + 1)
+        if k < len(tokens) and tokens[k][0] in ("word", "ident") and unquote(tokens[k]).upper() not in CLAUSE_END | {
+                "WHERE", "JOIN", "LEFT", "INNER", "CROSS", "NATURAL", "ON", "USING"}:
+            sources[unquote(tokens[k]).lower()] = table
+    return sources
+
+# Names defined in a WITH clause (`name AS (` / `name(cols) AS (`), which shadow real tables
+def cte_names(tokens):
+    names, level = set(), depths(tokens)
+    for i, token in enumerate(tokens):
+        if token[1] != "(" or i == 0:
+            continue
+        k = significant(tokens, i - 1, -1)
+        if k < 0 or not is_word(tokens[k], "AS"):
+            continue
+        k = significant(tokens, k - 1, -1)
+        if k >= 0 and tokens[k][1] == ")":
+            opening = max(j for j in range(k) if tokens[j][1] == "(" and level[j] == level[k])
+            k = significant(tokens, opening - 1, -1)
+        if k >= 0 and tokens[k][0] in ("word", "ident"):
+            names.add(unquote(tokens[k]).lower())
+    return names
+
+# (table, alias) when the query level around token i reads from exactly one real table
+def scope_table(tokens, i, db_path):
+    level = depths(tokens)
+    lo = max([k for k in range(i) if tokens[k][1] == "(" and level[k] == level[i] - 1] or [-1])
+    hi = matching_paren(tokens, lo) if lo >= 0 else len(tokens)
+    scope = [k for k in range(lo + 1, hi or len(tokens)) if level[k] == level[i] and tokens[k][0] not in ("ws", "comment")]
+    words = [tokens[k][1].upper() for k in scope if tokens[k][0] == "word"]
+    if words.count("FROM") != 1 or "JOIN" in words:
+        return None
+    at = scope.index(next(k for k in scope if is_word(tokens[k], "FROM")))
+    rest = scope[at + 1:]
+    if not rest or tokens[rest[0]][0] not in ("word", "ident"):
+        return None
+    table = {t.lower(): t for t in table_schemas(db_path)}.get(unquote(tokens[rest[0]]).lower())
+    alias = None
+    nxt = 1
+    if len(rest) > nxt and is_word(tokens[rest[nxt]], "AS"):
+        nxt += 1
+    if len(rest) > nxt and tokens[rest[nxt]][0] in ("word", "ident") and unquote(tokens[rest[nxt]]).upper() not in CLAUSE_END | {"WHERE"}:
+        alias = unquote(tokens[rest[nxt]])
+        nxt += 1
+    if len(rest) > nxt and tokens[rest[nxt]][1] == ",":
+        return None
+    return (table, alias) if table else None
+
+def like_to_regex(pattern):
+    out = "".join(".*" if ch == "%" else "." if ch == "_" else re.escape(ch) for ch in pattern)
+    # SQLite's LIKE folds ASCII case only
+    return re.compile(f"^{out}$", re.IGNORECASE | re.ASCII | re.S)
+
+def sql_string(value):
+    return "'" + value.replace("'", "''") + "'"
+
+def has_index_on(db_path, table, column):
+    conn = sqlite3.connect(db_path)
+    try:
+        for index in conn.execute(f"PRAGMA index_list({quote_ident(table)})").fetchall():
+            first = conn.execute(f"PRAGMA index_info({quote_ident(index[1])})").fetchone()
+            if first and first[2] and first[2].lower() == column.lower() and not index[4]:
+                return True
+    finally:
+        conn.close()
+    return False
+
+# col LIKE 'x' -> col = / IN (...) when the complete distinct-value list shows exactly which
+# values match; 'prefix%' -> indexed range when the prefix has no letters (case folding can't matter);
+# substring patterns on long text columns -> lookup in the column's trigram full-text index
+def rewrite_like(tokens, db_path, rewrites):
+    sources = source_tables(tokens, db_path)
+    if not sources:
+        return tokens
+    schemas = table_schemas(db_path)
+    ctes = cte_names(tokens)
+    out = list(tokens)
+    i = len(out)
+    while i > 0:
+        i -= 1
+        if not is_word(out[i], "LIKE"):
+            continue
+        p = significant(out, i + 1)
+        col = significant(out, i - 1, -1)
+        if p >= len(out) or out[p][0] != "str" or col < 0 or out[col][0] not in ("word", "ident"):
+            continue
+        after = significant(out, p + 1)
+        if after < len(out) and is_word(out[after], "ESCAPE"):
+            continue
+        start, qualifier = col, None
+        dot = significant(out, col - 1, -1)
+        if dot >= 0 and out[dot][1] == ".":
+            start = significant(out, dot - 1, -1)
+            if start < 0:
+                continue
+            qualifier = unquote(out[start]).lower()
+        before = significant(out, start - 1, -1)
+        if before >= 0 and is_word(out[before], "NOT"):
+            continue
+        # Only a column of the one real table this query level reads from: a derived table or
+        # CTE can reuse a base table's column name for different values
+        scope = scope_table(out, i, db_path)
+        if not scope or scope[0].lower() in ctes:
+            continue
+        table, alias = scope
+        if qualifier is not None and qualifier not in (table.lower(), (alias or "").lower()):
+            continue
+        column = unquote(out[col]).lower()
+        if dict(schemas[table]["columns"]).get(column) != "TEXT":
+            continue
+        pattern = out[p][1][1:-1].replace("''", "'")
+        col_sql = render(out[start:col + 1])
+
+        replacement = None
+        values = stats.distinct_values(db_path, table, column)
+        if values is not None and all(isinstance(v, str) for v in values):
+            regex = like_to_regex(pattern)
+            matched = [v for v in values if regex.match(v)]
+            if len(matched) == 1:
+                replacement = f"{col_sql} = {sql_string(matched[0])}"
+            elif 1 < len(matched) <= LIKE_MAX_VALUES:
+                replacement = f"{col_sql} IN ({', '.join(sql_string(v) for v in matched)})"
+        if replacement is None and pattern.endswith("%") and len(pattern) > 1:
+            prefix = pattern[:-1]
+            if not re.search(r"[%_A-Za-z]", prefix) and has_index_on(db_path, table, column):
+                upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+                replacement = f"({col_sql} >= {sql_string(prefix)} AND {col_sql} < {sql_string(upper)})"
+        if replacement is None and can_use_index(pattern):
+            index = ensure_index(db_path, table, column)
+            if index:
+                qualifier = render(out[start:col]).strip() if start != col else ""
+                replacement = f"{qualifier}rowid IN (SELECT rowid FROM {quote_ident(index)} WHERE {quote_ident(column)} LIKE {out[p][1]})"
+        if replacement:
+            rewrites.append(f"like: {render(out[start:p + 1])} -> {replacement}")
+            out[start:p + 1] = [("op", replacement)]
+            i = start
+    return out
+
+# ORDER BY in a subquery without LIMIT only matters for the order rows come out in, so it can go
+# when the subquery feeds IN/EXISTS, or the outer query sorts again and doesn't aggregate
+def drop_subquery_order(tokens, rewrites):
+    out = list(tokens)
+    i = 0
+    while i < len(out):
+        if out[i][1] != "(":
+            i += 1
+            continue
+        first = significant(out, i + 1)
+        end = matching_paren(out, i)
+        if end is None or first >= len(out) or not is_word(out[first], "SELECT"):
+            i += 1
+            continue
+        level = depths(out)
+        inner = [k for k in range(i + 1, end) if level[k] == level[i] + 1]
+        words = [out[k][1].upper() for k in inner if out[k][0] == "word"]
+        order = next((k for k in inner if is_word(out[k], "ORDER")), None)
+        if order is None or "LIMIT" in words or "OFFSET" in words:
+            i += 1
+            continue
+
+        before = significant(out, i - 1, -1)
+        redundant = before >= 0 and is_word(out[before], "IN", "EXISTS")
+        if not redundant and before >= 0 and (is_word(out[before], "FROM", "JOIN") or out[before][1] == ","):
+            # The enclosing query: same depth as the "(" between its own parens
+            lo = max([k for k in range(i) if out[k][1] == "(" and level[k] == level[i] - 1] or [-1])
+            hi = matching_paren(out, lo) if lo >= 0 else len(out)
+            outer = [out[k][1].upper() for k in range(lo + 1, hi or len(out)) if level[k] == level[i] and out[k][0] == "word"]
+            redundant = "ORDER" in outer and "GROUP" not in outer and "GROUP_CONCAT" not in render(out).upper()
+        if redundant:
+            rewrites.append(f"order: dropped {' '.join(render(out[order:end]).split())} in subquery")
+            out[order:end] = []
+            while out[order - 1][0] == "ws":
+                del out[order - 1]
+                order -= 1
+        i += 1
+    return out
+
+def _clause_end(tokens, start, level, depth):
+    for k in range(start, len(tokens)):
+        if level[k] < depth or (level[k] == depth and (is_word(tokens[k], *CLAUSE_END) or tokens[k][1] == ";")):
+            return k
+    return len(tokens)
+
+# SELECT ... FROM (SELECT cols FROM t [WHERE w]) x WHERE c  ->  the filter c moves into the subquery,
+# for plain projections only (no aggregates, DISTINCT, LIMIT, ...), so the result is unchanged
+def push_down_filters(tokens, rewrites):
+    level = depths(tokens)
+    top = [k for k in range(len(tokens)) if level[k] == 0 and tokens[k][0] != "ws"]
+    frm = next((k for k in top if is_word(tokens[k], "FROM")), None)
+    if frm is None or not is_word(tokens[top[0]], "SELECT"):
+        return tokens
+    open_ = significant(tokens, frm + 1)
+    if open_ >= len(tokens) or tokens[open_][1] != "(":
+        return tokens
+    close = matching_paren(tokens, open_)
+    if close is None:
+        return tokens
+    k = significant(tokens, close + 1)
+    if k < len(tokens) and is_word(tokens[k], "AS"):
+        k = significant(tokens, k + 1)
+    if k >= len(tokens) or tokens[k][0] not in ("word", "ident") or unquote(tokens[k]).upper() in CLAUSE_END | {"WHERE"}:
+        return tokens
+    alias = unquote(tokens[k]).lower()
+    where = significant(tokens, k + 1)
+    if where >= len(tokens) or not is_word(tokens[where], "WHERE"):
+        return tokens
+    cond_end = _clause_end(tokens, where + 1, level, 0)
+    cond = tokens[where + 1:cond_end]
+
+    # The subquery: SELECT <plain columns | *> FROM <table> [WHERE w] and nothing else
+    sub = tokens[open_ + 1:close]
+    sub_level = [d - 1 for d in level[open_ + 1:close]]
+    sub_words = [t[1].upper() for t, d in zip(sub, sub_level) if d == 0 and t[0] == "word"]
+    if not sub_words or sub_words[0] != "SELECT" or sub_words.count("FROM") != 1 or set(sub_words) & (
+            CLAUSE_END | {"DISTINCT", "JOIN", "OVER", "ALL"}):
+        return tokens
+    sub_from = next(i for i, (t, d) in enumerate(zip(sub, sub_level)) if d == 0 and is_word(t, "FROM"))
+    projection = [t for t in sub[1:sub_from] if t[0] != "ws"]
+    if [t[1] for t in projection] == ["*"]:
+        columns = None
+    else:
+        names, commas = projection[0::2], projection[1::2]
+        if any(t[0] not in ("word", "ident") for t in names) or any(t[1] != "," for t in commas):
+            return tokens
+        columns = {unquote(t).lower() for t in names}
+    rest = [t for t in sub[sub_from + 1:] if t[0] != "ws"]
+    if not rest or rest[0][0] not in ("word", "ident") or (len(rest) > 1 and not is_word(rest[1], "WHERE")):
+        return tokens
+
+    # Every column in the outer filter must come straight from the subquery's projection
+    pushed, i = [], 0
+    while i < len(cond):
+        token, nxt = cond[i], significant(cond, i + 1)
+        if token[0] in ("word", "ident") and not (token[0] == "word" and token[1].upper() in PREDICATE_WORDS):
+            if is_word(token, "SELECT"):
+                return tokens
+            if nxt < len(cond) and cond[nxt][1] == ".":
+                # alias.column -> column
+                if unquote(token).lower() != alias:
+                    return tokens
+                i = nxt + 1
+                continue
+            function = nxt < len(cond) and cond[nxt][1] == "("
+            if not function and columns is not None and unquote(token).lower() not in columns:
+                return tokens
+        pushed.append(token)
+        i += 1
+    pushed_sql = " ".join(render(pushed).split())
+    sub_sql = render(sub).rstrip()
+    if len(rest) > 1:
+        sub_where = next(i for i, (t, d) in enumerate(zip(sub, sub_level)) if d == 0 and is_word(t, "WHERE"))
+        new_sub = f"{render(sub[:sub_where + 1])} ({render(sub[sub_where + 1:]).strip()}) AND ({pushed_sql})"
+    else:
+        new_sub = f"{sub_sql} WHERE {pushed_sql}"
+    rewrites.append(f"pushdown: WHERE {pushed_sql} moved into subquery")
+    tail = tokens[cond_end:]
+    head = tokens[:open_ + 1] + [("op", new_sub)] + tokens[close:where]
+    while head and head[-1][0] == "ws":
+        head.pop()
+    return head + ([("ws", " ")] + tail if tail and tail[0][0] != "ws" else tail)
+
+# Rule-based rewrites of a read statement; each one is logged with its before/after query plan
+def optimize_sql(db_path, sql):
+    rewrites = []
+    tokens = tokenize(sql)
+    # Push-down first, so pushed filters get the LIKE rewrites too
+    tokens = push_down_filters(tokens, rewrites)
+    # The pushed-down subquery is spliced in as one opaque token: re-tokenize so later passes see inside it
+    if rewrites:
+        tokens = tokenize(render(tokens))
+    tokens = drop_subquery_order(tokens, rewrites)
+    tokens = rewrite_like(tokens, db_path, rewrites)
+    if not rewrites:
+        return sql, []
+    optimized = render(tokens)
+    print(f"Optimized SQL ({'; '.join(rewrites)})\n  before: {' '.join(sql.split())}\n    plan: {query_plan(db_path, sql)}"
+          f"\n  after:  {' '.join(optimized.split())}\n    plan: {query_plan(db_path, optimized)}")
+    return optimized, rewrites
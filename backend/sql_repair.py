@@ -0,0 +1,193 @@
+import os
+import re
+import sqlite3
+import difflib
+from schemas import quote_ident
+
+SQL_AUTO_LIMIT = int(os.getenv("SQL_AUTO_LIMIT", "10000"))
+MAX_REPAIRS = 5
+
+STRING_LITERAL_RE = re.compile(r"('(?:[^']|'')*')")
+NO_SUCH_RE = re.compile(r"no such (column|table): (\S+)|table \S+ has no (column) named (\S+)")
+AGGREGATE_RE = re.compile(r"\b(COUNT|SUM|AVG|MIN|MAX|TOTAL|GROUP_CONCAT)\s*\(", re.IGNORECASE)
+TOP_RE = re.compile(r"^\s*SELECT\s+(DISTINCT\s+)?TOP\s*\(?\s*(\d+)\s*\)?\s+", re.IGNORECASE)
+
+# MySQL/SQL Server date format codes that strftime understands
+DATE_FORMAT_CODES = {"%Y": "%Y", "%y": "%Y", "%m": "%m", "%c": "%m", "%d": "%d", "%e": "%d", "%H": "%H",
+                     "%k": "%H", "%i": "%M", "%s": "%S", "%S": "%S", "%j": "%j", "%W": "%w", "%%": "%%"}
+
+class SQLRepairError(Exception):
+    def __init__(self, sql, error):
+        super().__init__(str(error))
+        self.sql = sql
+
+def _outside_literals(sql, fn):
+    parts = STRING_LITERAL_RE.split(sql)
+    return "".join(part if i % 2 else fn(part) for i, part in enumerate(parts))
+
+def _split_args(text):
+    args, depth, start, quote = [], 0, 0, None
+    for i, ch in enumerate(text):
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in "'\"":
+            quote = ch
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "," and depth == 0:
+            args.append(text[start:i].strip())
+            start = i + 1
+    args.append(text[start:].strip())
+    return [a for a in args if a]
+
+def _convert_date_format(fmt):
+    inner = fmt[1:-1]
+    return "'" + re.sub(r"%.", lambda m: DATE_FORMAT_CODES.get(m.group(0), m.group(0)), inner) + "'"
+
+def _rewrite_call(name, args):
+    name = name.upper()
+    if name in ("NOW", "SYSDATE", "GETDATE", "CURRENT_TIMESTAMP") and not args:
+        return "datetime('now')"
+    if name in ("CURDATE", "CURRENT_DATE") and not args:
+        return "date('now')"
+    if name == "CONCAT" and args:
+        return "(" + " || ".join(args) + ")"
+    if name in ("YEAR", "MONTH", "DAY") and len(args) == 1:
+        code = {"YEAR": "%Y", "MONTH": "%m", "DAY": "%d"}[name]
+        return f"CAST(strftime('{code}', {args[0]}) AS INTEGER)"
+    if name == "DATE_FORMAT" and len(args) == 2 and args[1].startswith("'"):
+        return f"strftime({_convert_date_format(args[1])}, {args[0]})"
+    if name in ("LEN", "CHAR_LENGTH", "CHARACTER_LENGTH") and len(args) == 1:
+        return f"length({args[0]})"
+    if name == "ISNULL" and len(args) == 2:
+        return f"ifnull({args[0]}, {args[1]})"
+    if name == "ISNULL" and len(args) == 1:
+        return f"({args[0]} IS NULL)"
+    if name in ("RAND", "NEWID") and not args:
+        return "random()"
+    return None
+
+DIALECT_FUNCTIONS = ("NOW", "SYSDATE", "GETDATE", "CURRENT_TIMESTAMP", "CURDATE", "CURRENT_DATE", "CONCAT", "YEAR",
+                     "MONTH", "DAY", "DATE_FORMAT", "LEN", "CHAR_LENGTH", "CHARACTER_LENGTH", "ISNULL", "RAND", "NEWID")
+CALL_RE = re.compile(r"\b(" + "|".join(DIALECT_FUNCTIONS) + r")\s*\(", re.IGNORECASE)
+
+# Rewrites MySQL / SQL Server functions to their SQLite equivalents, innermost calls first
+def rewrite_dialect(sql, fixes):
+    for _ in range(50):
+        # Work on the text with literals masked so quotes inside strings do not confuse the scan
+        masked = STRING_LITERAL_RE.sub(lambda m: "'" + "_" * (len(m.group(0)) - 2) + "'", sql)
+        calls = [m for m in CALL_RE.finditer(masked) if not masked[:m.start()].rstrip().endswith(".")]
+        rewritten = False
+        for m in reversed(calls):
+            depth, end = 0, None
+            for i in range(m.end() - 1, len(masked)):
+                if masked[i] == "(":
+                    depth += 1
+                elif masked[i] == ")":
+                    depth -= 1
+                    if depth == 0:
+                        end = i
+                        break
+            if end is None:
+                continue
+            replacement = _rewrite_call(m.group(1), _split_args(sql[m.end():end]))
+            if replacement is None:
+                continue
+            fixes.append(f"{sql[m.start():end + 1]} -> {replacement}")
+            sql = sql[:m.start()] + replacement + sql[end + 1:]
+            rewritten = True
+            break
+        if not rewritten:
+            break
+
+    top = TOP_RE.match(sql)
+    if top and not has_top_level_limit(sql):
+        fixes.append(f"TOP {top.group(2)} -> LIMIT {top.group(2)}")
+        sql = f"SELECT {top.group(1) or ''}" + sql[top.end():] + f"\nLIMIT {top.group(2)}"
+    return sql
+
+def top_level_words(sql):
+    masked = STRING_LITERAL_RE.sub("''", sql)
+    depth, words = 0, []
+    for token in re.findall(r"\(|\)|\w+", masked):
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0:
+            words.append(token.upper())
+    return words
+
+def has_top_level_limit(sql):
+    return "LIMIT" in top_level_words(sql)
+
+# An aggregate without GROUP BY returns one row, a LIMIT there is just noise
+def is_bounded(sql):
+    words = top_level_words(sql)
+    if "LIMIT" in words:
+        return True
+    if "GROUP" in words or "UNION" in words or "FROM" not in words:
+        return "FROM" not in words
+    select_list = re.split(r"\bFROM\b", STRING_LITERAL_RE.sub("''", sql), maxsplit=1, flags=re.IGNORECASE)[0]
+    return bool(AGGREGATE_RE.search(select_list))
+
+def _replace_identifier(sql, wrong, right):
+    pattern = re.compile(r'(?<![\w])(?:"' + re.escape(wrong) + r'"|`' + re.escape(wrong) + r'`|\[' + re.escape(wrong) + r'\]|' + re.escape(wrong) + r')(?![\w])', re.IGNORECASE)
+    return _outside_literals(sql, lambda part: pattern.sub(lambda m: quote_ident(right), part))
+
+def catalog(db_path, tables):
+    conn = sqlite3.connect(db_path)
+    try:
+        return {t: [c[1] for c in conn.execute(f"PRAGMA table_info({quote_ident(t)})")] for t in tables}
+    finally:
+        conn.close()
+
+# Compiles the statement with EXPLAIN (nothing runs) and fixes what can be fixed locally:
+# dialect functions, misspelled columns/tables, missing LIMIT on reads.
+# Returns (sql, fixes); raises SQLRepairError when only the LLM can fix it. The added LIMIT
+# is a safety bound, not a correction, so it is not listed in fixes (see hit_auto_limit).
+def repair_sql(db_path, sql, tables, active_table=None):
+    fixes = []
+    sql = rewrite_dialect(sql, fixes)
+    cat = catalog(db_path, tables)
+    # Columns of the active table win ties with same-named columns elsewhere
+    columns = list(dict.fromkeys(cat.get(active_table, []) + [c for cols in cat.values() for c in cols]))
+
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("PRAGMA query_only = ON")
+        for _ in range(MAX_REPAIRS + 1):
+            try:
+                conn.execute(f"EXPLAIN {sql}")
+                break
+            except sqlite3.Error as e:
+                match = NO_SUCH_RE.search(str(e))
+                if not match:
+                    raise SQLRepairError(sql, e)
+                kind, wrong = (match.group(1), match.group(2)) if match.group(1) else (match.group(3), match.group(4))
+                name = wrong.split(".")[-1]
+                candidates = columns if kind == "column" else list(cat)
+                close = difflib.get_close_matches(name.lower(), [c.lower() for c in candidates], n=1, cutoff=0.75)
+                if not close:
+                    raise SQLRepairError(sql, e)
+                right = next(c for c in candidates if c.lower() == close[0])
+                repaired = _replace_identifier(sql, name, right)
+                if repaired == sql:
+                    raise SQLRepairError(sql, e)
+                fixes.append(f"{kind} {name} -> {right}")
+                sql = repaired
+        else:
+            raise SQLRepairError(sql, "too many errors to repair")
+    finally:
+        conn.close()
+
+    if SQL_AUTO_LIMIT and not is_bounded(sql) and sql.lstrip("( \n\t").split(None, 1)[0].lower() in ("select", "with"):
+        sql = f"{sql}\nLIMIT {SQL_AUTO_LIMIT}"
+    return sql, fixes
+
+# Whether the result filled the LIMIT repair_sql adds, i.e. rows may have been cut off
+def hit_auto_limit(sql, rows):
+    return bool(SQL_AUTO_LIMIT) and len(rows) >= SQL_AUTO_LIMIT and sql.endswith(f"\nLIMIT {SQL_AUTO_LIMIT}")
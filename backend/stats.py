@@ -0,0 +1,68 @@
+import os
+import sqlite3
+import threading
+from schemas import table_schemas, table_version, quote_ident
+
+STATS_MAX_DISTINCT = int(os.getenv("STATS_MAX_DISTINCT", "200"))
+# A text column is categorical when it repeats values: at most this share of rows is distinct
+CATEGORICAL_MAX_RATIO = 0.5
+
+# Per-column statistics (distinct values for the optimizer, categorical value lists for
+# entity resolution), computed lazily or at upload. Entries are tied to the
+# table's content: they are dropped when the table's version changes and whenever
+# a write goes through the SQL tool (invalidate()).
+class StatsCatalog:
+    def __init__(self):
+        self._columns = {}
+        self._categorical = {}
+        self._lock = threading.Lock()
+
+    # Complete list of distinct values, or None when the column has more than STATS_MAX_DISTINCT
+    def distinct_values(self, db_path, table, column):
+        key = (db_path, table, column.lower())
+        version = table_version(db_path, table)
+        cached = self._columns.get(key)
+        if cached and cached[0] == version:
+            return cached[1]
+        conn = sqlite3.connect(db_path)
+        try:
+            # DISTINCT ... LIMIT stops early on high-cardinality columns
+            rows = conn.execute(f"SELECT DISTINCT {quote_ident(column)} FROM {quote_ident(table)} LIMIT ?", (STATS_MAX_DISTINCT + 1,)).fetchall()
+        finally:
+            conn.close()
+        values = [r[0] for r in rows] if len(rows) <= STATS_MAX_DISTINCT else None
+        with self._lock:
+            self._columns[key] = (version, values)
+        return values
+
+    # {column: [distinct values]} for the table's categorical text columns
+    def categorical_values(self, db_path, table):
+        version = table_version(db_path, table)
+        if version is None:
+            return {}
+        cached = self._categorical.get((db_path, table))
+        if cached and cached[0] == version:
+            return cached[1]
+        conn = sqlite3.connect(db_path)
+        try:
+            rows = conn.execute(f"SELECT COUNT(*) FROM {quote_ident(table)}").fetchone()[0]
+        finally:
+            conn.close()
+        values = {}
+        for column, kind in table_schemas(db_path).get(table, {}).get("columns", []):
+            if kind != "TEXT":
+                continue
+            distinct = self.distinct_values(db_path, table, column)
+            if distinct and len(distinct) <= max(1, rows * CATEGORICAL_MAX_RATIO):
+                values[column] = [v for v in distinct if isinstance(v, str) and v.strip()]
+        with self._lock:
+            self._categorical[(db_path, table)] = (version, values)
+        return values
+
+    def invalidate(self, db_path, table=None):
+        with self._lock:
+            for cache in (self._columns, self._categorical):
+                for key in [k for k in cache if k[0] == db_path and (table is None or k[1] == table)]:
+                    del cache[key]
+
+stats = StatsCatalog()
@@ -0,0 +1,74 @@
+import ast
+import json
+from langchain_core.callbacks import BaseCallbackHandler
+
+FINAL_ANSWER_MARKER = "Final Answer:"
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def notify(callbacks, event):
+    for cb in callbacks or []:
+        if hasattr(cb, "on_progress"):
+            cb.on_progress(event)
+
+def count_rows(output):
+    output = str(output)
+    # Skip the repair note the query tool may put in front of the rows
+    if output.startswith("Note:"):
+        output = output.split("\n", 1)[1] if "\n" in output else ""
+    try:
+        parsed = ast.literal_eval(output)
+        return len(parsed) if isinstance(parsed, (list, tuple)) else None
+    except Exception:
+        return 0 if not output.strip() else None
+
+# Turns agent callbacks into (event, payload) tuples on a queue.
+# Only the text after "Final Answer:" is forwarded as answer tokens; thoughts and actions become step events.
+class StreamingHandler(BaseCallbackHandler):
+    def __init__(self, events):
+        self.events = events
+        self.buffer = ""
+        self.in_answer = False
+        self.streamed_tokens = False
+        self.tools = {}
+
+    def on_progress(self, event):
+        self.events.put(("step", event))
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.buffer = ""
+        self.in_answer = False
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.buffer = ""
+        self.in_answer = False
+
+    def on_llm_new_token(self, token, **kwargs):
+        if not isinstance(token, str) or not token:
+            return
+        if self.in_answer:
+            self.emit_token(token)
+            return
+        self.buffer += token
+        if FINAL_ANSWER_MARKER in self.buffer:
+            self.in_answer = True
+            self.emit_token(self.buffer.split(FINAL_ANSWER_MARKER, 1)[1].lstrip())
+
+    def emit_token(self, text):
+        if text:
+            self.streamed_tokens = True
+            self.events.put(("token", {"text": text}))
+
+    def on_agent_action(self, action, **kwargs):
+        if action.tool == "sql_db_query":
+            self.on_progress({"type": "sql", "sql": str(action.tool_input).strip()})
+        else:
+            self.on_progress({"type": "tool", "tool": action.tool})
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self.tools[run_id] = (serialized or {}).get("name") or kwargs.get("name")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        if self.tools.pop(run_id, None) == "sql_db_query":
+            self.on_progress({"type": "rows", "rows": count_rows(output)})
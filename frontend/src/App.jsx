@@ -1,9 +1,10 @@
-import { useState, useCallback } from 'react';
+import { useState, useCallback, useRef } from 'react';
 import axios from 'axios';
 import LandingPage from './LandingPage';
 import ChatbotUI from './ChatbotUI';
 
 const API_BASE = import.meta.env.VITE_API_URL || 'http://localhost:8001';
+const ASK_MODE = import.meta.env.VITE_ASK_MODE || 'agent';
 
 // The main app component
 function App() {
@@ -12,64 +13,9 @@ function App() {
     const [messages, setMessages] = useState([]);
     const [input, setInput] = useState("");
     const [loading, setLoading] = useState(false);
-
-    // Helper to find chart data inside the AI's message
-    const extractChartData = (content) => {
-        try {
-            const codeBlockRegex = /```(?:\w*)?\s*([\s\S]*?)\s*```/g;
-            const matches = [...content.matchAll(codeBlockRegex)];
-
-            for (const match of matches) {
-                try {
-                    const candidate = match[1].trim();
-                    const sanitized = candidate.replace(/'/g, '"');
-                    const parsed = JSON.parse(candidate) || JSON.parse(sanitized);
-                    if (parsed.type === 'chart') return parsed;
-                } catch (e) { }
-            }
-
-            const markers = ['{"type": "chart"', '{"type":"chart"', "{'type': 'chart'", "{'type':'chart'"];
-            let start = -1;
-
-            for (const marker of markers) {
-                start = content.indexOf(marker);
-                if (start !== -1) break;
-            }
-
-            if (start !== -1) {
-                let braces = 0;
-                let inString = false;
-                for (let i = start; i < content.length; i++) {
-                    const char = content[i];
-                    if (char === '"' && content[i - 1] !== '\\') inString = !inString;
-                    if (!inString) {
-                        if (char === '{') braces++;
-                        if (char === '}') braces--;
-                    }
-                    if (braces === 0) {
-                        try {
-                            const candidate = content.substring(start, i + 1);
-                            const sanitized = candidate.replace(/'/g, '"');
-                            const parsed = JSON.parse(candidate) || JSON.parse(sanitized);
-                            return parsed;
-                        } catch (e) {
-                        }
-                    }
-                }
-            }
-
-            const looseMatch = content.match(/\{[\s\S]*?"type":\s*["']chart["'][\s\S]*?\}/);
-            if (looseMatch) {
-                try {
-                    return JSON.parse(looseMatch[0]);
-                } catch (e) { }
-            }
-
-        } catch (e) {
-            console.error("Chart parsing failed", e);
-        }
-        return null;
-    };
+    const [status, setStatus] = useState("");
+    // Conversation history lives on the server; we only keep the session id
+    const sessionId = useRef(null);
 
     // Sends the file to the server
     const handleUpload = async (targetFile) => {
@@ -104,23 +50,86 @@ function App() {
         }
     };
 
-    // Sends message to the AI
+    // Reads server-sent events from a fetch body and hands each (event, data) pair to onEvent
+    const readEventStream = async (body, onEvent) => {
+        const reader = body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const frames = buffer.split('\n\n');
+            buffer = frames.pop();
+            for (const frame of frames) {
+                const event = frame.match(/^event: (.*)$/m)?.[1];
+                const data = frame.match(/^data: (.*)$/m)?.[1];
+                if (event && data) onEvent(event, JSON.parse(data));
+            }
+        }
+    };
+
+    // Describes an agent step for the loading indicator
+    const describeStep = (step) => {
+        if (step.type === 'sql') return `Running SQL: ${step.sql}`;
+        if (step.type === 'rows') return `${step.rows ?? 'Some'} rows returned`;
+        if (step.type === 'escalate') return `Retrying with ${step.model}`;
+        return `Using ${step.tool}`;
+    };
+
+    // Sends message to the AI and renders the answer as it streams in
     const sendMessage = async () => {
-        if (!input.trim()) return;
+        if (!input.trim() || loading) return;
 
-        const userMsg = { role: 'user', content: input };
+        const question = input;
+        const userMsg = { role: 'user', content: question };
         setMessages(prev => [...prev, userMsg]);
         setInput("");
         setLoading(true);
-
+        setStatus("");
+
+        // Creates the streaming AI message on first use, then patches it in place
+        const upsertAnswer = (patch) => setMessages(prev => {
+            const last = prev[prev.length - 1];
+            if (last && last.role === 'ai' && last.streaming) return [...prev.slice(0, -1), { ...last, ...patch }];
+            return [...prev, { role: 'ai', streaming: true, ...patch }];
+        });
+        const finishAnswer = (data) => {
+            if (data.session_id) sessionId.current = data.session_id;
+            upsertAnswer({ content: data.answer, chart: data.chart || null, streaming: false });
+        };
+        const payload = { question, session_id: sessionId.current, mode: ASK_MODE, chart_format: 'columnar' };
+
+        let received = false;
         try {
-            const { data } = await axios.post(`${API_BASE}/ask`, { question: input, history: messages });
-            const chart = extractChartData(data.answer);
-            setMessages(prev => [...prev, { role: 'ai', content: data.answer, chart }]);
+            const res = await fetch(`${API_BASE}/ask/stream`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(payload)
+            });
+            if (!res.ok || !res.body) throw new Error(`Streaming unavailable (${res.status})`);
+
+            let streamed = '';
+            await readEventStream(res.body, (event, data) => {
+                received = true;
+                if (event === 'step') setStatus(describeStep(data));
+                if (event === 'token') {
+                    streamed += data.text;
+                    upsertAnswer({ content: streamed });
+                }
+                if (event === 'done' || event === 'error') finishAnswer(data);
+            });
         } catch (err) {
-            setMessages(prev => [...prev, { role: 'ai', content: "Neural link interrupted. Please retry." }]);
+            try {
+                if (received) throw err;
+                const { data } = await axios.post(`${API_BASE}/ask`, payload);
+                finishAnswer(data);
+            } catch (e) {
+                setMessages(prev => [...prev.filter(m => !m.streaming), { role: 'ai', content: "Neural link interrupted. Please retry." }]);
+            }
         } finally {
             setLoading(false);
+            setStatus("");
         }
     };
 
@@ -136,6 +145,7 @@ function App() {
             onDownload={handleDownload}
             setFile={setFile}
             loading={loading}
+            status={status}
             onBack={() => setView('landing')}
         />
     );
@@ -6,12 +6,26 @@ import {
 
 const PALETTE = ['#8884d8', '#82ca9d', '#ffc658', '#0088FE', '#00C49F', '#FFBB28', '#FF8042'];
 
+// Columnar charts send numeric series as base64 buffers; view them as typed arrays without parsing
+const decodeColumn = (col) => {
+  if (Array.isArray(col)) return col;
+  const bytes = Uint8Array.from(atob(col.data), c => c.charCodeAt(0));
+  return col.dtype === 'int32' ? new Int32Array(bytes.buffer) : new Float64Array(bytes.buffer);
+};
+
 const ChartRenderer = ({ chartConfig }) => {
-  if (!chartConfig || !chartConfig.data) return null;
+  if (!chartConfig || !(chartConfig.data || chartConfig.columns)) return null;
 
-  const { chartType, data, xAxis, yAxis, title } = chartConfig;
+  const { chartType, data, columns, xAxis, yAxis, title, sampled } = chartConfig;
+  const columnar = chartConfig.format === 'columnar';
+
+  // Columnar payloads: one array per series, read by row index instead of remapped into objects
+  const series = React.useMemo(() => (
+    columnar ? { x: decodeColumn(columns[xAxis]), y: decodeColumn(columns[yAxis]) } : null
+  ), [columnar, columns, xAxis, yAxis]);
 
   const formattedData = React.useMemo(() => {
+    if (columnar) return Array.from({ length: chartConfig.length }, (_, i) => i);
     if (!Array.isArray(data) || data.length === 0) return [];
     return data.map(item => {
       let obj = {};
@@ -25,7 +39,10 @@ const ChartRenderer = ({ chartConfig }) => {
       }
       return obj;
     });
-  }, [data, xAxis, yAxis]);
+  }, [columnar, chartConfig.length, data, xAxis, yAxis]);
+
+  const xKey = columnar ? (i) => series.x[i] : xAxis;
+  const yKey = columnar ? (i) => series.y[i] : yAxis;
 
   const STYLES = {
     tooltip: { backgroundColor: '#0f172a', borderRadius: '12px', border: '1px solid #334155', boxShadow: '0 10px 15px -3px rgba(0,0,0,0.5)' },
@@ -35,7 +52,7 @@ const ChartRenderer = ({ chartConfig }) => {
 
   const AxisLabels = ({ x, y }) => (
     <>
-      <XAxis dataKey={xAxis} {...STYLES.axis}><Label value={x} offset={-20} position="insideBottom" style={STYLES.label} /></XAxis>
+      <XAxis dataKey={xKey} {...STYLES.axis}><Label value={x} offset={-20} position="insideBottom" style={STYLES.label} /></XAxis>
       <YAxis {...STYLES.axis}><Label value={y} angle={-90} position="insideLeft" offset={-30} style={STYLES.label} /></YAxis>
     </>
   );
@@ -49,7 +66,7 @@ const ChartRenderer = ({ chartConfig }) => {
             <AxisLabels x={xAxis} y={yAxis} />
             <Tooltip contentStyle={STYLES.tooltip} itemStyle={{ color: '#f8fafc' }} />
             <Legend verticalAlign="top" height={36} />
-            <Bar dataKey={yAxis} fill="#6366f1" radius={[4, 4, 0, 0]} />
+            <Bar dataKey={yKey} name={yAxis} fill="#6366f1" radius={[4, 4, 0, 0]} />
           </BarChart>
         );
       case 'line':
@@ -59,13 +76,13 @@ const ChartRenderer = ({ chartConfig }) => {
             <AxisLabels x={xAxis} y={yAxis} />
             <Tooltip contentStyle={STYLES.tooltip} itemStyle={{ color: '#f8fafc' }} />
             <Legend verticalAlign="top" height={36} />
-            <Line type="monotone" dataKey={yAxis} stroke="#6366f1" strokeWidth={3} dot={{ r: 4, fill: '#6366f1' }} activeDot={{ r: 6 }} />
+            <Line type="monotone" dataKey={yKey} name={yAxis} stroke="#6366f1" strokeWidth={3} dot={{ r: 4, fill: '#6366f1' }} activeDot={{ r: 6 }} />
           </LineChart>
         );
       case 'pie':
         return (
           <PieChart>
-            <Pie data={formattedData} cx="50%" cy="50%" innerRadius={60} outerRadius={80} paddingAngle={5} dataKey={yAxis} nameKey={xAxis}>
+            <Pie data={formattedData} cx="50%" cy="50%" innerRadius={60} outerRadius={80} paddingAngle={5} dataKey={yKey} nameKey={xKey}>
               {formattedData.map((_, i) => <Cell key={i} fill={PALETTE[i % PALETTE.length]} />)}
             </Pie>
             <Tooltip contentStyle={STYLES.tooltip} itemStyle={{ color: '#f8fafc' }} />
@@ -84,7 +101,7 @@ const ChartRenderer = ({ chartConfig }) => {
             <CartesianGrid strokeDasharray="3 3" vertical={false} stroke="#334155" />
             <AxisLabels x={xAxis} y={yAxis} />
             <Tooltip contentStyle={STYLES.tooltip} itemStyle={{ color: '#f8fafc' }} />
-            <Area type="monotone" dataKey={yAxis} stroke="#6366f1" fill="url(#areaGrad)" strokeWidth={3} />
+            <Area type="monotone" dataKey={yKey} name={yAxis} stroke="#6366f1" fill="url(#areaGrad)" strokeWidth={3} />
           </AreaChart>
         );
       default:
@@ -95,6 +112,7 @@ const ChartRenderer = ({ chartConfig }) => {
   return (
     <div className="w-full h-60 md:h-80 my-4 p-4 bg-slate-900/40 rounded-2xl border border-white/5 ring-1 ring-white/5 overflow-hidden">
       {title && <h3 className="text-[10px] font-bold uppercase tracking-widest text-slate-400 mb-4 ml-1">{title}</h3>}
+      {sampled && <p className="text-[10px] text-slate-500 -mt-3 mb-3 ml-1">Showing {sampled.to.toLocaleString()} of {sampled.from.toLocaleString()} points ({sampled.method})</p>}
       <ResponsiveContainer width="100%" height="90%">{renderComponent()}</ResponsiveContainer>
     </div>
   );
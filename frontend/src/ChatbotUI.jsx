@@ -91,7 +91,7 @@ const MiniMagneticString = () => {
 };
 
 // The main chat interface
-const ChatbotUI = ({ messages, input, setInput, onSend, onUpload, onDownload, setFile, loading, onBack }) => {
+const ChatbotUI = ({ messages, input, setInput, onSend, onUpload, onDownload, setFile, loading, status, onBack }) => {
     const scrollRef = useRef(null);
 
     useEffect(() => {
@@ -250,7 +250,7 @@ const ChatbotUI = ({ messages, input, setInput, onSend, onUpload, onDownload, se
                                     {msg.content && (
                                         <div className="prose prose-invert prose-sm max-w-none">
                                             <ReactMarkdown>
-                                                {msg.chart ? msg.content.replace(/```json[\s\S]*?```/g, '').replace(/\{[\s\S]*?\}/g, '').trim() : msg.content}
+                                                {msg.content}
                                             </ReactMarkdown>
                                         </div>
                                     )}
@@ -282,7 +282,7 @@ const ChatbotUI = ({ messages, input, setInput, onSend, onUpload, onDownload, se
                             </div>
                             <div className="bg-zinc-900/40 border border-white/5 p-4 rounded-2xl rounded-tl-none flex items-center gap-3">
                                 <Loader2 size={16} className="animate-spin text-orange-500" />
-                                <span className="text-xs font-medium text-slate-500 uppercase tracking-widest">Processing...</span>
+                                <span className="text-xs font-medium text-slate-500 uppercase tracking-widest max-w-xs md:max-w-lg truncate">{status || 'Processing...'}</span>
                             </div>
                         </div>
                     </motion.div>